@@ -1,12 +1,16 @@
 import os
+import sys
 import gc
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
-import torch
-import torchvision.transforms as torchvision_T
-from torchvision.models.segmentation import deeplabv3_mobilenet_v3_large
-import onnxruntime as ort
 import warnings
+
+# torch is only needed for .pth checkpoints and onnxruntime only for .onnx models, so an ONNX-only worker can run
+# without installing torch/torchvision. Both are imported on first model load, not at import time: callers that never
+# crop (crop=False, postProcess only, replay) do not pay several seconds of torch/onnxruntime import.
 warnings.filterwarnings("ignore", category=FutureWarning)
 
 # Suppress ONNX Runtime warnings by setting environment variables
@@ -35,14 +39,78 @@ def find_dest(pts):
     destination_corners = [[0, 0], [maxWidth, 0], [maxWidth, maxHeight], [0, maxHeight]]
     return order_points(destination_corners)
 
-def image_preproces_transforms(mean=(0.4611, 0.4359, 0.3905), std=(0.2193, 0.2150, 0.2109)):
-    common_transforms = torchvision_T.Compose(
-        [torchvision_T.ToTensor(), torchvision_T.Normalize(mean, std)]
-    )
-    return common_transforms
+MEAN = (0.4611, 0.4359, 0.3905)
+STD = (0.2193, 0.2150, 0.2109)
+
+def preprocess_image(image_model, mean=MEAN, std=STD, out=None):
+    # Same as torchvision ToTensor + Normalize, in NumPy: HWC -> 1xCxHxW float32
+    # Written channel by channel into `out` (allocated if not given) without full-size temporaries
+    image_model = np.asarray(image_model)
+    H, W, C = image_model.shape
+    if out is None:
+        out = np.empty((1, C, H, W), dtype=np.float32)
+    scale = np.float32(255.0 if image_model.dtype == np.uint8 else 1.0)
+    for c in range(C):
+        channel = out[0, c]
+        np.divide(image_model[:, :, c], scale, out=channel, dtype=np.float32)
+        np.subtract(channel, np.float32(mean[c]), out=channel)
+        np.divide(channel, np.float32(std[c]), out=channel)
+    return out
+
+# Per-thread scratch buffers for the low-memory path, reused across calls while the shape stays the same
+_buffers = threading.local()
+
+def _buffer(name, shape, dtype):
+    buffers = _buffers.__dict__
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = buffers[name] = np.zeros(shape, dtype=dtype)
+    return buffer
+
+# stats dicts of the extract() calls measuring peak RSS right now. The peak is process-wide, so a call that overlaps
+# another one (concurrent API jobs) cannot tell its own peak and reports None instead
+_rss_lock = threading.Lock()
+_rss_calls = {}
+
+def reset_peak_rss():
+    # On Linux writing 5 to clear_refs resets VmHWM, so the next peak_rss_mb() is the peak since this call
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def model_format(checkpoint_path):
+    if checkpoint_path.endswith('.pth'):
+        return 'torch'
+    elif checkpoint_path.endswith('.onnx'):
+        return 'onnx'
+    else:
+        raise ValueError("Unsupported model format. Supported formats are .pth and .onnx")
 
 def load_autocrop_model(checkpoint_path, device):
-    if checkpoint_path.endswith('.pth'):
+    if model_format(checkpoint_path) == 'torch':
+        try:
+            import torch
+            from torchvision.models.segmentation import deeplabv3_mobilenet_v3_large
+        except ImportError:
+            raise ImportError("torch and torchvision are required for .pth checkpoints; export an .onnx model with autocrop_kh.export") from None
         num_classes = 2
         model = deeplabv3_mobilenet_v3_large(num_classes=num_classes)
         model.to(device)
@@ -50,51 +118,106 @@ def load_autocrop_model(checkpoint_path, device):
         model.load_state_dict(checkpoints, strict=False)
         model.eval()
         return model, 'torch'
-    elif checkpoint_path.endswith('.onnx'):
+    else:
         # Load the ONNX model
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("onnxruntime is required for .onnx models") from None
         session = ort.InferenceSession(checkpoint_path, providers=['CUDAExecutionProvider' if device == 'cuda' else 'CPUExecutionProvider'])
         return session, 'onnx'
-    else:
-        raise ValueError("Unsupported model format. Supported formats are .pth and .onnx")
-
-preprocess_transforms = image_preproces_transforms()
 
-def extract(image_true=None, trained_model=None, image_size=384, BUFFER=10, device=None, model_type='torch'):
+# Process-wide model registry keyed by (path, device, format), so each checkpoint is loaded only once
+_model_cache = {}
+_model_cache_lock = threading.Lock()
+
+def get_autocrop_model(checkpoint_path, device):
+    key = (os.path.abspath(checkpoint_path), device, model_format(checkpoint_path))
+    cached = _model_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with _model_cache_lock:
+        # Another thread may have loaded the model while we were waiting for the lock
+        if key not in _model_cache:
+            _model_cache[key] = load_autocrop_model(checkpoint_path, device)
+        return _model_cache[key]
+
+def warmup_autocrop_model(checkpoint_path, device, image_size=384):
+    # Load the model into the registry and run one dummy forward pass so the first request does not pay for it
+    trained_model, model_type = get_autocrop_model(checkpoint_path, device)
+    dummy = np.zeros((1, 3, image_size, image_size), dtype=np.float32)
+    run_model(dummy, trained_model, device=device, model_type=model_type)
+    return trained_model, model_type
+
+def clear_autocrop_model_cache():
+    with _model_cache_lock:
+        _model_cache.clear()
+
+def run_model(image_model, trained_model, device=None, model_type='torch'):
+    # image_model: 1xCxHxW float32 NumPy array, returns the logits as a NumPy array
+    if model_type == 'torch':
+        import torch  # Already loaded by load_autocrop_model()
+        image_model = torch.from_numpy(image_model).to(device)
+        with torch.no_grad():
+            out = trained_model(image_model)["out"].cpu().numpy()
+    elif model_type == 'onnx':
+        model_input = trained_model.get_inputs()[0]
+        if model_input.shape[0] == 1 and image_model.shape[0] > 1:
+            # Model exported with a fixed batch size of 1: run the images one by one
+            out = np.concatenate([trained_model.run(None, {model_input.name: image_model[i:i + 1]})[0] for i in range(image_model.shape[0])])
+        else:
+            out = trained_model.run(None, {model_input.name: image_model})[0]
+    return out
+
+def predict_masks(images, trained_model, image_size=384, device=None, model_type='torch', batch_size=16, low_memory=False):
+    # Segment the documents at image_size x image_size, batch_size images per forward pass,
+    # and return one class mask (1 = document) per image
+    masks = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        shape = (len(chunk), 3, image_size, image_size)
+        image_model = _buffer("model_input", shape, np.float32) if low_memory else np.empty(shape, dtype=np.float32)
+        for i, image in enumerate(chunk):
+            resized = cv2.resize(image, (image_size, image_size), interpolation=cv2.INTER_NEAREST)
+            preprocess_image(resized, out=image_model[i:i + 1])
+
+        out = run_model(image_model, trained_model, device=device, model_type=model_type)
+
+        del image_model
+        if not low_memory:
+            gc.collect()
+
+        masks.extend(np.argmax(out, axis=1).astype(np.uint8 if low_memory else np.int32))
+    return masks
+
+def predict_mask(image_true, trained_model, image_size=384, device=None, model_type='torch', low_memory=False):
+    return predict_masks([image_true], trained_model, image_size=image_size, device=device, model_type=model_type, low_memory=low_memory)[0]
+
+def find_page_corners(mask, imH, imW, image_size=384, low_memory=False):
+    # Approximate the largest contour of the mask and scale its corners to the original image size
     IMAGE_SIZE = image_size
     half = IMAGE_SIZE // 2
-
-    imH, imW, C = image_true.shape
-    image_model = cv2.resize(image_true, (IMAGE_SIZE, IMAGE_SIZE), interpolation=cv2.INTER_NEAREST)
     scale_x = imW / IMAGE_SIZE
     scale_y = imH / IMAGE_SIZE
 
-    image_model = preprocess_transforms(image_model)
-    image_model = torch.unsqueeze(image_model, dim=0)
+    r_H, r_W = mask.shape
 
-    if model_type == 'torch':
-        image_model = image_model.to(device)
-        with torch.no_grad():
-            out = trained_model(image_model)["out"].cpu()
-    elif model_type == 'onnx':
-        image_model = image_model.numpy()  # Convert tensor to numpy for ONNX
-        input_name = trained_model.get_inputs()[0].name
-        output = trained_model.run(None, {input_name: image_model})
-        out = torch.tensor(output[0])
-
-    del image_model
-    gc.collect()
-
-    out = torch.argmax(out, dim=1, keepdims=True).permute(0, 2, 3, 1)[0].numpy().squeeze().astype(np.int32)
-    r_H, r_W = out.shape
+    if low_memory:
+        # uint8 canvas reused between calls; only the center is ever written, so the border stays zero
+        out = _buffer("mask_canvas", (IMAGE_SIZE + r_H, IMAGE_SIZE + r_W), np.uint8)
+        np.multiply(mask, 255, out=out[half: half + IMAGE_SIZE, half: half + IMAGE_SIZE], casting="unsafe")
+    else:
+        _out_extended = np.zeros((IMAGE_SIZE + r_H, IMAGE_SIZE + r_W), dtype=mask.dtype)
+        _out_extended[half: half + IMAGE_SIZE, half: half + IMAGE_SIZE] = mask * 255
+        out = _out_extended.copy()
 
-    _out_extended = np.zeros((IMAGE_SIZE + r_H, IMAGE_SIZE + r_W), dtype=out.dtype)
-    _out_extended[half: half + IMAGE_SIZE, half: half + IMAGE_SIZE] = out * 255
-    out = _out_extended.copy()
+        del _out_extended
+        gc.collect()
 
-    del _out_extended
-    gc.collect()
+        out = out.astype(np.uint8)
 
-    canny = cv2.Canny(out.astype(np.uint8), 225, 255)
+    canny = cv2.Canny(out, 225, 255)
     canny = cv2.dilate(canny, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
     contours, _ = cv2.findContours(canny, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
     page = sorted(contours, key=cv2.contourArea, reverse=True)[0]
@@ -107,6 +230,22 @@ def extract(image_true=None, trained_model=None, image_size=384, BUFFER=10, devi
     corners[:, 1] -= half
     corners[:, 0] *= scale_x
     corners[:, 1] *= scale_y
+    return corners
+
+def is_whole_frame(corners, imH, imW, tolerance=0.02):
+    # True if every image corner has a page corner within tolerance (share of the image side), i.e. the model found
+    # no page inside the frame. A skewed page that fills the frame is not whole-frame even if its warp has the same size.
+    corners = np.asarray(corners, dtype=np.float32).reshape(-1, 2)
+    for x, y in ((0, 0), (imW, 0), (imW, imH), (0, imH)):
+        near = (np.abs(corners[:, 0] - x) <= imW * tolerance) & (np.abs(corners[:, 1] - y) <= imH * tolerance)
+        if not near.any():
+            return False
+    return True
+
+def warp_page(image_true, corners, BUFFER=10, low_memory=False):
+    # Pad the image if the corners fall outside of it, then warp the page to a flat rectangle
+    # low_memory: never copy the photo; the input dtype (uint8) is kept and the result is not clipped in float
+    imH, imW, C = image_true.shape
 
     if not (np.all(corners.min(axis=0) >= (0, 0)) and np.all(corners.max(axis=0) <= (imW, imH))):
         left_pad, top_pad, right_pad, bottom_pad = 0, 0, 0, 0
@@ -132,15 +271,18 @@ def extract(image_true=None, trained_model=None, image_size=384, BUFFER=10, devi
         if box_y_max >= imH:
             bottom_pad = (box_y_max - imH) + BUFFER
 
-        image_extended = np.zeros((top_pad + bottom_pad + imH, left_pad + right_pad + imW, C), dtype=image_true.dtype)
-        image_extended[top_pad: top_pad + imH, left_pad: left_pad + imW, :] = image_true
-        image_extended = image_extended.astype(np.float32)
+        # In low-memory mode nothing is padded: zero padding is the same as warpPerspective's constant
+        # zero border, so the original image is warped with the unshifted box corners instead of a padded float copy
+        if not low_memory:
+            image_extended = np.zeros((top_pad + bottom_pad + imH, left_pad + right_pad + imW, C), dtype=image_true.dtype)
+            image_extended[top_pad: top_pad + imH, left_pad: left_pad + imW, :] = image_true
+            image_extended = image_extended.astype(np.float32)
 
-        box_corners[:, 0] += left_pad
-        box_corners[:, 1] += top_pad
+            box_corners[:, 0] += left_pad
+            box_corners[:, 1] += top_pad
+            image_true = image_extended
 
         corners = box_corners
-        image_true = image_extended
 
     corners = sorted(corners.tolist())
     corners = order_points(corners)
@@ -148,13 +290,45 @@ def extract(image_true=None, trained_model=None, image_size=384, BUFFER=10, devi
     M = cv2.getPerspectiveTransform(np.float32(corners), np.float32(destination_corners))
 
     final = cv2.warpPerspective(image_true, M, (destination_corners[2][0], destination_corners[2][1]), flags=cv2.INTER_LANCZOS4)
+    if low_memory:
+        return final  # OpenCV already saturates uint8 output to 0..255
     final = np.clip(final, a_min=0., a_max=255.)
 
     return final
 
-def autocrop(img_path=None, np_image=None, pil_image=None, model_path=None, device=None):
-    # Load the model and determine type (torch or onnx)
-    trained_model, model_type = load_autocrop_model(checkpoint_path=model_path, device=device)
+def extract(image_true=None, trained_model=None, image_size=384, BUFFER=10, device=None, model_type='torch', low_memory=False, stats=None,
+            return_corners=False):
+    # stats: optional dict, filled with the call's duration and peak RSS (MB, since the start of the call on Linux;
+    # None if another measured call overlapped it)
+    # return_corners: return (page, corners found in image_true) instead of only the page
+    if stats is not None:
+        with _rss_lock:
+            stats["overlapped"] = bool(_rss_calls)
+            for other in _rss_calls.values():
+                other["overlapped"] = True
+            _rss_calls[id(stats)] = stats
+            peak_reset = reset_peak_rss()
+        start = time.perf_counter()
+
+    try:
+        imH, imW, C = image_true.shape
+
+        mask = predict_mask(image_true, trained_model, image_size=image_size, device=device, model_type=model_type, low_memory=low_memory)
+        corners = find_page_corners(mask, imH, imW, image_size=image_size, low_memory=low_memory)
+        final = warp_page(image_true, corners, BUFFER, low_memory=low_memory)
+    finally:
+        if stats is not None:
+            with _rss_lock:
+                del _rss_calls[id(stats)]
+                overlapped = stats.pop("overlapped")
+                stats["peak_rss_mb"] = None if overlapped else peak_rss_mb()
+            stats["seconds"] = time.perf_counter() - start
+            stats["peak_rss_scope"] = "concurrent" if overlapped else "call" if peak_reset else "process"
+    return (final, corners) if return_corners else final
+
+def autocrop(img_path=None, np_image=None, pil_image=None, model_path=None, device=None, low_memory=False, stats=None, return_corners=False):
+    # Get the model from the process-wide registry (loaded on first use) and determine type (torch or onnx)
+    trained_model, model_type = get_autocrop_model(checkpoint_path=model_path, device=device)
 
     if img_path:
         # If img_path is provided, read the image from disk
@@ -169,7 +343,38 @@ def autocrop(img_path=None, np_image=None, pil_image=None, model_path=None, devi
         raise ValueError("No image input provided. Please provide img_path, np_image, or pil_image.")
 
     # Perform document extraction
-    extracted_image = extract(image_true=image, trained_model=trained_model, device=device, model_type=model_type)
+    extracted_image = extract(image_true=image, trained_model=trained_model, device=device, model_type=model_type,
+                              low_memory=low_memory, stats=stats, return_corners=return_corners)
 
     return extracted_image
 
+def load_rgb(image):
+    # Image path, PIL image or RGB NumPy array -> RGB NumPy array
+    if isinstance(image, (str, os.PathLike)):
+        return cv2.imread(os.fspath(image), cv2.IMREAD_COLOR)[:, :, ::-1]
+    if isinstance(image, np.ndarray):
+        return image
+    return np.array(image)
+
+def autocrop_batch(images, model_path=None, device=None, batch_size=16, workers=None, image_size=384, BUFFER=10, low_memory=False,
+                   return_corners=False):
+    # Crop several images with one forward pass per batch_size images (much better CPU throughput than
+    # one image at a time). Contour and perspective post-processing runs per image, in a thread pool if
+    # workers > 1 (OpenCV releases the GIL). Returns the cropped images (or (image, corners) pairs) in input order.
+    trained_model, model_type = get_autocrop_model(checkpoint_path=model_path, device=device)
+
+    images = [load_rgb(image) for image in images]
+    masks = predict_masks(images, trained_model, image_size=image_size, device=device, model_type=model_type,
+                          batch_size=batch_size, low_memory=low_memory)
+
+    def postprocess(item):
+        image, mask = item
+        imH, imW = image.shape[:2]
+        corners = find_page_corners(mask, imH, imW, image_size=image_size, low_memory=low_memory)
+        final = warp_page(image, corners, BUFFER, low_memory=low_memory)
+        return (final, corners) if return_corners else final
+
+    if workers and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(postprocess, zip(images, masks)))
+    return [postprocess(item) for item in zip(images, masks)]
@@ -0,0 +1,195 @@
+# Export the autocrop DeepLabV3-MobileNetV3 checkpoint to ONNX and optionally quantize it to INT8.
+#
+# The exported model takes a fixed 3x384x384 input (only the batch dimension is dynamic) and returns the
+# segmentation logits, so it can be loaded by load_autocrop_model() and run with onnxruntime alone.
+# After export/quantization the page corners found by each new model are compared with the reference
+# model on sample receipts; the command fails if any corner moves more than --tolerance (fraction of the
+# longer image side).
+#
+# Usage:
+#   python -m autocrop_kh.export models/autocrop_model_v2.pth
+#   python -m autocrop_kh.export models/autocrop_model_v2.pth --quantize static --calibration receipts
+#   python -m autocrop_kh.export models/autocrop_model_v2.onnx --quantize dynamic
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from autocrop_kh import load_autocrop_model, model_format, predict_mask, find_page_corners, order_points, preprocess_image
+
+IMAGE_SIZE = 384
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+RECEIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "receipts")
+
+def export_onnx(checkpoint_path, onnx_path, image_size=IMAGE_SIZE, opset=17):
+    import torch
+
+    model, _ = load_autocrop_model(checkpoint_path, "cpu")
+
+    # torchvision segmentation models return a dict, ONNX needs a plain tensor output
+    class SegmentationLogits(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, image):
+            return self.model(image)["out"]
+
+    dummy = torch.zeros((1, 3, image_size, image_size), dtype=torch.float32)
+    torch.onnx.export(
+        SegmentationLogits(model).eval(), dummy, onnx_path,
+        input_names=["image"], output_names=["out"],
+        dynamic_axes={"image": {0: "batch"}, "out": {0: "batch"}},
+        opset_version=opset, do_constant_folding=True,
+    )
+    return onnx_path
+
+def load_images(directory, limit=None):
+    paths = sorted(p for p in glob.glob(os.path.join(directory, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+    if limit:
+        paths = paths[:limit]
+    images = []
+    for path in paths:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append((path, image[:, :, ::-1]))  # BGR -> RGB, same as autocrop()
+    return images
+
+def quantize_model(onnx_path, output_path, mode="dynamic", calibration_images=None, image_size=IMAGE_SIZE):
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+    if mode == "dynamic":
+        quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QInt8)
+        return output_path
+
+    if not calibration_images:
+        raise ValueError("Static quantization needs calibration images")
+
+    input_name = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    # Feeds receipts through the same resize + normalization as predict_mask()
+    class ReceiptCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self._images = iter(calibration_images)
+
+        def get_next(self):
+            item = next(self._images, None)
+            if item is None:
+                return None
+            resized = cv2.resize(item[1], (image_size, image_size), interpolation=cv2.INTER_NEAREST)
+            return {input_name: preprocess_image(resized)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_input = onnx_path
+        try:
+            from onnxruntime.quantization.shape_inference import quant_pre_process
+            model_input = os.path.join(tmp, "preprocessed.onnx")
+            quant_pre_process(onnx_path, model_input)
+        except ImportError:  # Older onnxruntime versions: quantize the model as is
+            pass
+
+        quantize_static(
+            model_input, output_path, ReceiptCalibrationReader(),
+            quant_format=QuantFormat.QDQ, per_channel=True,
+            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+        )
+    return output_path
+
+def page_quad(image, trained_model, model_type, image_size=IMAGE_SIZE):
+    # The four ordered page corners extract() would start from, in original image coordinates
+    imH, imW = image.shape[:2]
+    mask = predict_mask(image, trained_model, image_size=image_size, device="cpu", model_type=model_type)
+    corners = find_page_corners(mask, imH, imW, image_size=image_size)
+    return np.float32(order_points(sorted(corners.tolist())))
+
+def verify_corners(reference_path, candidate_path, images, tolerance=0.01, image_size=IMAGE_SIZE):
+    reference, reference_type = load_autocrop_model(reference_path, "cpu")
+    candidate, candidate_type = load_autocrop_model(candidate_path, "cpu")
+
+    failures = 0
+    timings = {"reference": 0.0, "candidate": 0.0}
+    for path, image in images:
+        start = time.perf_counter()
+        expected = page_quad(image, reference, reference_type, image_size)
+        timings["reference"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = page_quad(image, candidate, candidate_type, image_size)
+        timings["candidate"] += time.perf_counter() - start
+
+        error = float(np.abs(actual - expected).max()) / max(image.shape[:2])
+        status = "ok" if error <= tolerance else "MISMATCH"
+        if error > tolerance:
+            failures += 1
+        print(f"  {os.path.basename(path):<20} max corner error {error:.4f} {status}")
+
+    count = max(len(images), 1)
+    print(f"  mean crop inference: {os.path.basename(reference_path)} {timings['reference'] / count * 1000:.1f} ms, "
+          f"{os.path.basename(candidate_path)} {timings['candidate'] / count * 1000:.1f} ms")
+    return failures
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export the autocrop model to ONNX and optionally quantize it to INT8.")
+    parser.add_argument("checkpoint", help="Source model (.pth checkpoint, or an existing .onnx to quantize)")
+    parser.add_argument("-o", "--output", help="ONNX output path (default: checkpoint path with .onnx)")
+    parser.add_argument("--image-size", type=int, default=IMAGE_SIZE)
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--quantize", choices=["dynamic", "static"], help="Also write an INT8 model")
+    parser.add_argument("--quantized-output", help="INT8 output path (default: <output>.int8.onnx)")
+    parser.add_argument("--calibration", default=RECEIPTS_DIR, help="Image directory for static calibration")
+    parser.add_argument("--calibration-count", type=int, default=32)
+    parser.add_argument("--verify", default=RECEIPTS_DIR, help="Image directory for the corner check")
+    parser.add_argument("--verify-count", type=int, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Max corner error as a fraction of the longer image side")
+    parser.add_argument("--no-verify", action="store_true")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    reference_path = args.checkpoint
+    candidates = []
+
+    if model_format(args.checkpoint) == "torch":
+        onnx_path = args.output or os.path.splitext(args.checkpoint)[0] + ".onnx"
+        export_onnx(args.checkpoint, onnx_path, image_size=args.image_size, opset=args.opset)
+        print(f"Exported {onnx_path}")
+        candidates.append(onnx_path)
+    else:
+        onnx_path = args.checkpoint
+
+    if args.quantize:
+        quantized_path = args.quantized_output or os.path.splitext(onnx_path)[0] + ".int8.onnx"
+        calibration_images = load_images(args.calibration, args.calibration_count) if args.quantize == "static" else None
+        quantize_model(onnx_path, quantized_path, args.quantize, calibration_images, image_size=args.image_size)
+        print(f"Quantized ({args.quantize}) {quantized_path}")
+        candidates.append(quantized_path)
+
+    if args.no_verify or not candidates:
+        return 0
+
+    images = load_images(args.verify, args.verify_count)
+    if not images:
+        print(f"No images in {args.verify}, skipping corner check")
+        return 0
+
+    failures = 0
+    for candidate_path in candidates:
+        print(f"Comparing crop corners of {candidate_path} with {reference_path} on {len(images)} images")
+        failures += verify_corners(reference_path, candidate_path, images, args.tolerance, args.image_size)
+
+    if failures:
+        print(f"{failures} images exceed the corner tolerance of {args.tolerance}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
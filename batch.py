@@ -0,0 +1,195 @@
+# Bir klasördeki (veya glob desenine uyan) tüm fiş/fatura görüntülerini çok süreçli olarak işleyen batch komutu.
+#
+# - Dosyalar N worker sürecine dağıtılır, her worker autocrop modelini başlangıçta bir kez yükler.
+# - Her görüntü için bir JSON satırı (sonuç, hata, süre ve kullanılan OCR geçişi sayısı) stdout'a veya dosyaya yazılır.
+# - --resume ile daha önce başarıyla işlenmiş görüntüler atlanır, yarıda kalan işler kaldığı yerden devam eder.
+# - Worker'lar görüntüleri --crop-batch'lik gruplar halinde alır, grubun autocrop'u tek model çalıştırmasında yapılır.
+# - --store ile ham OCR metinleri kaydedilir, --replay ile OCR yapılmadan kayıtlı metinler üzerinden tekrar çalışılır.
+#
+# Örnek:
+#   python batch.py receipts/ -o results.jsonl -w 8 --resume
+#   python batch.py "receipts/S*.jpg" --agreement 3 > results.jsonl
+
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+# main.py ve processImage.py stdout'a debug mesajları basıyor, JSONL çıktısını bozmasınlar diye stderr'e yönlendiriyoruz
+with contextlib.redirect_stdout(sys.stderr):
+    from main import run_with_report, set_ocr_backend, prefetch_crops, ScenarioGraph, RegionGraph
+    from processImage import warmup_crop_model
+    from ocr_store import OCRTextStore
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+# Worker süreçlerinde geçerli ayarlar (init_worker tarafından doldurulur)
+_worker_options = {}
+
+# Klasör verilirse içindeki görüntüleri, değilse glob desenine uyan dosyaları sıralı olarak döndürür
+def collect_images(source):
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS))
+
+# Önceki çıktı dosyasından başarıyla işlenmiş görüntülerin yollarını okur (hatalı olanlar tekrar denenir)
+def load_completed(output_path):
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:  # Yarıda kesilmiş son satır
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["path"])
+    return completed
+
+# Her worker süreci başlarken bir kez çalışır: OCR backend'ini seçer ve autocrop modelini yükler
+def init_worker(options):
+    sys.stdout = sys.stderr
+    _worker_options.update(options)
+
+    if options.get("store"):
+        _worker_options["store"] = OCRTextStore(options["store"])
+
+    if options.get("backend"):
+        set_ocr_backend(options["backend"])
+
+    if options.get("warmup") and not options.get("replay"):
+        try:
+            warmup_crop_model()
+        except Exception as e:
+            print(f"Autocrop model warmup failed in worker {os.getpid()}: {e}")
+
+# Tek bir görüntüyü işler ve JSONL'e yazılacak kaydı döndürür (hatalar da kayıt olarak döner)
+# graph verilirse (bkz. process_chunk) önceden yapılmış kırpma kullanılır
+def process_image(path, graph=None):
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    record = {"path": path}
+
+    try:
+        result, report = run_with_report(path, agreement=_worker_options.get("agreement"), save_results=False,
+                                         store=_worker_options.get("store"), replay=_worker_options.get("replay", False), graph=graph,
+                                         roi=_worker_options.get("roi", False), profile=_worker_options.get("profile"))
+        record.update({"status": "ok", "result": result, "passes_used": report["passes_used"]})
+        if "crop_peak_rss_mb" in report:
+            record["crop_peak_rss_mb"] = report["crop_peak_rss_mb"]
+        if "est_seconds_saved" in report:
+            record["est_seconds_saved"] = report["est_seconds_saved"]
+    except Exception as e:
+        record.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+
+    record["wall_ms"] = round((time.perf_counter() - wall_start) * 1000, 1)
+    record["cpu_ms"] = round((time.process_time() - cpu_start) * 1000, 1)
+    record["worker"] = os.getpid()
+    return record
+
+# Bir grup görüntüyü işler: önce hepsinin autocrop'u birlikte yapılır, sonra her biri ayrı ayrı OCR'lanır.
+# Toplu kırpmanın süresi görüntülere eşit bölünüp crop_ms olarak kayda eklenir.
+def process_chunk(paths):
+    if len(paths) == 1 or _worker_options.get("replay"):
+        return [process_image(path) for path in paths]
+
+    graph_class = RegionGraph if _worker_options.get("roi") else ScenarioGraph
+    graphs = [graph_class(path) for path in paths]
+    start = time.perf_counter()
+    try:
+        prefetch_crops(graphs, batch_size=len(graphs))
+    except Exception as e:  # Görüntüler tek tek kırpılır, hatalı görüntü kendi kaydında görünür
+        print(f"Batched autocrop failed in worker {os.getpid()}, cropping one by one: {e}")
+    crop_ms = round((time.perf_counter() - start) * 1000 / len(paths), 1)
+
+    records = []
+    for path, graph in zip(paths, graphs):
+        record = process_image(path, graph)
+        record["crop_ms"] = crop_ms
+        records.append(record)
+    return records
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Batch OCR for receipt/bill images, one JSON line per image.")
+    parser.add_argument("source", help="Image directory or glob pattern (e.g. 'receipts/S*.jpg')")
+    parser.add_argument("-o", "--output", help="JSONL output file (default: stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--resume", action="store_true", help="Skip images already processed successfully in --output")
+    parser.add_argument("--agreement", type=int, default=None, help="Early-exit vote margin for required fields (0 or default: run all passes)")
+    parser.add_argument("--backend", default=None, help="OCR backend (pytesseract or tesserocr)")
+    parser.add_argument("--profile", default=None, help="Pass schedule profile name or .json path (see pass_schedule.py)")
+    parser.add_argument("--store", default=None, help="Persist raw OCR texts to this SQLite store")
+    parser.add_argument("--replay", action="store_true", help="Re-run extraction from --store texts, skip imaging and OCR")
+    parser.add_argument("--roi", action="store_true", help="OCR only the lines holding key fields after one full-page pass")
+    parser.add_argument("--crop-batch", type=int, default=8,
+                        help="Images per batched autocrop forward pass (1 = crop lazily per image, better with --agreement)")
+    parser.add_argument("--no-warmup", action="store_true", help="Do not preload the autocrop model in workers")
+    args = parser.parse_args(argv)
+    if args.agreement is not None and args.agreement < 0:
+        parser.error("--agreement must be 0 (off) or at least 1")
+    args.agreement = args.agreement or None  # API'deki OCR_AGREEMENT gibi 0 erken çıkışı kapatır
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.resume and not args.output:
+        print("--resume requires --output", file=sys.stderr)
+        return 2
+
+    if args.replay and not args.store:
+        print("--replay requires --store", file=sys.stderr)
+        return 2
+
+    if args.replay and args.roi:
+        print("--roi cannot be combined with --replay", file=sys.stderr)
+        return 2
+
+    paths = collect_images(args.source)
+    if args.resume:
+        completed = load_completed(args.output)
+        paths = [p for p in paths if p not in completed]
+        print(f"Resuming: {len(completed)} images already done", file=sys.stderr)
+
+    print(f"Processing {len(paths)} images with {args.workers} workers", file=sys.stderr)
+    if not paths:
+        return 0
+
+    options = {"agreement": args.agreement, "backend": args.backend, "warmup": not args.no_warmup,
+               "store": args.store, "replay": args.replay, "roi": args.roi, "profile": args.profile}
+    output = open(args.output, "a" if args.resume else "w", encoding="utf-8") if args.output else sys.stdout
+
+    ok, failed = 0, 0
+    start = time.perf_counter()
+    try:
+        # Az görüntü varsa gruplar küçültülür, böylece tüm worker'lar iş alır
+        crop_batch = max(1, min(args.crop_batch, -(-len(paths) // args.workers)))
+        chunks = [paths[i:i + crop_batch] for i in range(0, len(paths), crop_batch)]
+        with multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(options,)) as pool:
+            for records in pool.imap_unordered(process_chunk, chunks):
+                for record in records:
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    if record["status"] == "ok":
+                        ok += 1
+                    else:
+                        failed += 1
+                output.flush()  # Yarıda kesilirse --resume tamamlanan satırları görebilsin
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Done: {ok} ok, {failed} failed in {elapsed:.1f}s ({(ok + failed) / elapsed:.2f} images/s)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
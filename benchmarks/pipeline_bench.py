@@ -0,0 +1,237 @@
+# receipts/ korpusu üzerinde aşama bazlı pipeline benchmark'ı.
+#
+# Her fiş için geçiş planının (varsayılan: tüm senaryolar x PSM, OCR_PASS_PROFILE ile profil) tüm geçişleri erken
+# çıkış olmadan sırayla çalıştırılır ve her aşamanın duvar saati süresi, CPU süresi (tesseract alt süreçleri dahil) ve tepe belleği (RSS) ölçülür:
+#   decode, autocrop, normalize, preprocess, ocr_psm<N>, is_receipt, extract_fields, parse_items, merge_field_results
+# Aşamalar ScenarioGraph üzerinden çağrılır, yani aynı girdiye sahip geçişler pipeline'daki gibi bir kez hesaplanır.
+# Sonuç fiş başına ve aşama başına toplamları içeren bir JSON raporudur; iki rapor karşılaştırılıp eşiği aşan
+# yavaşlamalar regresyon olarak işaretlenebilir (regresyon varsa çıkış kodu 1).
+#
+# Örnek:
+#   python benchmarks/pipeline_bench.py -o bench/before.json
+#   python benchmarks/pipeline_bench.py -o bench/after.json --baseline bench/before.json --threshold 0.1
+#   python benchmarks/pipeline_bench.py --compare bench/before.json bench/after.json
+
+import argparse
+import contextlib
+import glob
+import json
+import os
+import platform
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+METRICS = ["wall_s", "cpu_s"]
+
+try:
+    import resource
+except ImportError:  # Windows: alt süreçlerin CPU süresi ölçülemez
+    resource = None
+
+# Bu süreç ve beklenmiş alt süreçlerinin (pytesseract'ın başlattığı tesseract) toplam CPU süresi
+def cpu_seconds():
+    total = time.process_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        total += children.ru_utime + children.ru_stime
+    return total
+
+# Aşama sürelerini toplayan yardımcı: aynı isimli aşama bir fişte birden fazla çalışırsa süreler toplanır,
+# tepe bellek en büyüğü alınır
+class StageTimer:
+    def __init__(self, reset_peak, peak_mb):
+        self._reset_peak = reset_peak
+        self._peak_mb = peak_mb
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self._reset_peak()
+        wall, cpu = time.perf_counter(), cpu_seconds()
+        try:
+            yield
+        finally:
+            entry = self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": None, "calls": 0})
+            entry["wall_s"] += time.perf_counter() - wall
+            entry["cpu_s"] += cpu_seconds() - cpu
+            entry["calls"] += 1
+            peak = self._peak_mb()
+            if peak is not None:
+                entry["peak_rss_mb"] = max(entry["peak_rss_mb"] or 0.0, peak)
+
+# Tek bir fişi tüm senaryo ve PSM'lerle çalıştırır, aşama ölçümlerini döndürür
+def bench_receipt(path, main):
+    timer = StageTimer(main.reset_peak_rss, main.peak_rss_mb)
+    graph = main.ScenarioGraph(path)
+
+    with timer.stage("decode"):
+        graph.decoded()
+        graph.crop_source()
+    passes = main.resolve_passes()
+    if any(crop for crop, _, _ in passes):
+        with timer.stage("autocrop"):
+            graph.cropped()
+
+    sources = sorted({crop for crop, _, _ in passes})
+    for crop in sources:
+        with timer.stage("normalize"):  # OCR_NORMALIZE kapalıysa sadece decode/kırpma sonucunu döndürür
+            graph.scenario_image(crop, False)
+        if any(c == crop and pre_process for c, pre_process, _ in passes):
+            with timer.stage("preprocess"):
+                graph.scenario_image(crop, True)
+
+    texts = []
+    for crop, pre_process, psm in passes:
+        with timer.stage(f"ocr_psm{psm}"):
+            texts.append((psm, graph.text(crop, pre_process, psm)))
+
+    with timer.stage("is_receipt"):  # Pipeline ile aynı: planın ilk len(PSM_VALUES) geçişinin metinleri
+        receipt = any(main.is_receipt(text) for psm, text in texts[:len(main.PSM_VALUES)])
+
+    results = []
+    with timer.stage("extract_fields"):
+        for psm, text in texts:
+            results.append(main.extract_fields(text, receipt))
+    if receipt:
+        with timer.stage("parse_items"):
+            for psm, text in texts:
+                if psm != 11:  # Pipeline ile aynı: PSM 11 alt kalem için kullanılmaz
+                    main.parse_items(text)
+
+    with timer.stage("merge_field_results"):
+        main.merge_field_results(results)
+
+    return {"stages": timer.stages, "ocr_calls": graph.ocr_calls, "receipt": receipt}
+
+def summarize(receipts):
+    stages = {}
+    for record in receipts.values():
+        for name, entry in record.get("stages", {}).items():
+            total = stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": None, "calls": 0, "receipts": 0})
+            total["wall_s"] += entry["wall_s"]
+            total["cpu_s"] += entry["cpu_s"]
+            total["calls"] += entry["calls"]
+            total["receipts"] += 1
+            if entry["peak_rss_mb"] is not None:
+                total["peak_rss_mb"] = max(total["peak_rss_mb"] or 0.0, entry["peak_rss_mb"])
+    for total in stages.values():
+        total["mean_wall_s"] = total["wall_s"] / total["receipts"]
+    overall = {metric: sum(s[metric] for s in stages.values()) for metric in METRICS}
+    return stages, overall
+
+def run_benchmark(paths, warmup=True):
+    with contextlib.redirect_stdout(sys.stderr):  # main/processImage debug çıktıları rapor tablosuna karışmasın
+        import main
+        from processImage import warmup_crop_model
+        if warmup and any(crop for crop, _, _ in main.resolve_passes()):
+            warmup_crop_model()  # Model yükleme süresi autocrop aşamasına yazılmasın
+
+        receipts = {}
+        for path in paths:
+            name = os.path.basename(path)
+            try:
+                receipts[name] = bench_receipt(path, main)
+            except Exception as e:
+                receipts[name] = {"error": f"{type(e).__name__}: {e}"}
+            print(f"{name}: {'error' if 'error' in receipts[name] else 'ok'}", file=sys.stderr)
+
+    stages, overall = summarize(receipts)
+    meta = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ocr_backend": main.get_ocr_backend().name,
+        "model_path": os.path.relpath(main.MODEL_PATH, ROOT_DIR),
+        "normalize": main.NORMALIZE_RESOLUTION,
+        "preprocess_chain": main.PREPROCESS_CHAIN,
+        "images": len(paths),
+        "peak_rss_scope": "stage" if main.reset_peak_rss() else "process",
+    }
+    return {"meta": meta, "stages": stages, "total": overall, "receipts": receipts}
+
+def print_report(report):
+    print(f"{report['meta']['images']} receipts, backend {report['meta']['ocr_backend']}\n")
+    print(f"{'stage':<22}{'wall':>10}{'cpu':>10}{'mean/receipt':>15}{'peak rss':>12}")
+    for name, stage in report["stages"].items():
+        peak = f"{stage['peak_rss_mb']:.0f} MB" if stage["peak_rss_mb"] is not None else "-"
+        print(f"{name:<22}{stage['wall_s']:>8.2f} s{stage['cpu_s']:>8.2f} s{stage['mean_wall_s'] * 1000:>12.1f} ms{peak:>12}")
+    print(f"{'total':<22}{report['total']['wall_s']:>8.2f} s{report['total']['cpu_s']:>8.2f} s")
+
+# İki raporun aşama sürelerini karşılaştırır. Bir aşama baseline'a göre threshold oranından ve min_delta saniyeden
+# fazla yavaşladıysa (veya tepe belleği threshold oranından fazla arttıysa) regresyon sayılır
+def compare_reports(baseline, current, threshold=0.1, min_delta=0.005):
+    regressions = []
+    names = list(baseline["stages"]) + [name for name in current["stages"] if name not in baseline["stages"]]
+    print(f"{'stage':<22}{'wall before':>13}{'after':>10}{'wall':>9}{'cpu':>9}{'peak rss':>10}")
+    for name in names:
+        old, new = baseline["stages"].get(name), current["stages"].get(name)
+        if old is None or new is None:
+            print(f"{name:<22}  only in {'current' if old is None else 'baseline'}")
+            continue
+        changes, flags = [], []
+        for metric in METRICS + ["peak_rss_mb"]:
+            before, after = old.get(metric), new.get(metric)
+            if before is None or after is None:
+                changes.append("-")
+                continue
+            change = (after - before) / before if before else 0.0
+            changes.append(f"{change:+.1%}")
+            significant = metric == "peak_rss_mb" or after - before > min_delta
+            if change > threshold and significant:
+                regressions.append((name, metric, before, after, change))
+                flags.append(metric)
+        flag = f"  REGRESSION ({', '.join(flags)})" if flags else ""
+        print(f"{name:<22}{old['wall_s']:>11.3f} s{new['wall_s']:>8.3f} s{changes[0]:>9}{changes[1]:>9}{changes[2]:>10}{flag}")
+    return regressions
+
+def load_report(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage wall/CPU/memory benchmark of the OCR pipeline over the receipts corpus.")
+    parser.add_argument("--images", default=os.path.join(ROOT_DIR, "receipts", "S*.jpg"), help="Glob of receipt images")
+    parser.add_argument("--limit", type=int, default=None, help="Only benchmark the first N images")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="Compare the new report with this JSON report")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Only compare two existing reports")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown counted as a regression (default 0.1 = 10%%)")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="Ignore slowdowns smaller than this many seconds")
+    parser.add_argument("--no-warmup", action="store_true", help="Include autocrop model loading in the first receipt")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        baseline, current = (load_report(path) for path in args.compare)
+    else:
+        paths = sorted(glob.glob(args.images), key=lambda p: (len(p), p))  # S2 < S10
+        if args.limit:
+            paths = paths[:args.limit]
+        if not paths:
+            print(f"No images match {args.images}")
+            return 1
+        current = run_benchmark(paths, warmup=not args.no_warmup)
+        print_report(current)
+        if args.output:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(current, f, ensure_ascii=False, indent=2)
+            print(f"\nReport written to {args.output}")
+        if not args.baseline:
+            return 0
+        baseline = load_report(args.baseline)
+        print()
+
+    regressions = compare_reports(baseline, current, args.threshold, args.min_delta)
+    if regressions:
+        print(f"\n{len(regressions)} regressions beyond {args.threshold:.0%}")
+        return 1
+    print(f"\nNo regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
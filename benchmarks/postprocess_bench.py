@@ -0,0 +1,65 @@
+# postProcess fonksiyonları için mikro benchmark.
+#
+# ocr_outputs/ altındaki kayıtlı OCR metinleri (4 senaryo x 4 PSM = bir fişin 16 metni) üzerinde alan çıkarımı,
+# alt kalem ayrıştırma ve karakter düzeltme fonksiyonlarının çağrı başına süresini ölçer.
+#
+# Örnek:
+#   python benchmarks/postprocess_bench.py
+#   python benchmarks/postprocess_bench.py --texts ocr_outputs --repeat 7 --number 200
+
+import argparse
+import glob
+import os
+import sys
+import timeit
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from postProcess import extract_fields, extract_batch, parse_items, fix_common_ocr_errors, is_receipt, merge_field_results
+
+def load_texts(directory):
+    texts = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+        with open(path, encoding="utf-8") as f:
+            texts.append(f.read())
+    return texts
+
+# Her senaryo için (isim, bir fişin tüm metinlerini işleyen fonksiyon) döndürür
+def build_cases(texts):
+    item_mask = [i % 4 != 0 for i in range(len(texts))]  # PSM 11 (her senaryonun ilk metni) alt kalem için kullanılmaz
+    receipt_results = [extract_fields(text, True) for text in texts]
+    tokens = [token for text in texts for token in text.split()]
+
+    return [
+        ("fix_common_ocr_errors", lambda: [fix_common_ocr_errors(token) for token in tokens]),  # Regex yakalamaları gibi kısa parçalar
+        ("is_receipt", lambda: [is_receipt(text) for text in texts]),
+        ("extract_fields (receipt)", lambda: [extract_fields(text, True) for text in texts]),
+        ("extract_fields (bill)", lambda: [extract_fields(text, False) for text in texts]),
+        ("parse_items", lambda: [parse_items(text) for text, use in zip(texts, item_mask) if use]),
+        ("extract_batch (receipt)", lambda: extract_batch(texts, True, item_mask)),
+        ("merge_field_results", lambda: merge_field_results(receipt_results)),
+    ]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark postProcess over stored OCR texts.")
+    parser.add_argument("--texts", default=os.path.join(ROOT_DIR, "ocr_outputs"), help="Directory with OCR .txt outputs")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    texts = load_texts(args.texts)
+    if not texts:
+        print(f"No .txt files in {args.texts}")
+        return 1
+
+    print(f"{len(texts)} texts, {sum(len(t) for t in texts)} characters, best of {args.repeat} x {args.number}\n")
+    print(f"{'case':<28}{'per receipt':>14}{'per text':>12}")
+    for name, func in build_cases(texts):
+        best = min(timeit.repeat(func, repeat=args.repeat, number=args.number)) / args.number
+        print(f"{name:<28}{best * 1e6:>11.1f} us{best * 1e6 / len(texts):>9.1f} us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
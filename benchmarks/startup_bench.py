@@ -0,0 +1,80 @@
+# main.py için başlangıç (cold start) benchmark'ı.
+#
+# Her ölçüm yeni bir Python sürecinde yapılır, böylece batch worker'ı, test.py veya insert_to_db.py başlatmanın
+# gerçek maliyeti görülür:
+# - import: `python -c "import main"` süresi ve import sonrası yüklenmiş ağır modüller (torch, onnxruntime...),
+# - no-crop / crop: süreç başlangıcından ilk run() sonucuna kadar geçen süre (import, model yükleme ve OCR dahil).
+#
+# Örnek:
+#   python benchmarks/startup_bench.py
+#   python benchmarks/startup_bench.py --image receipts/S2.jpg --repeat 5 --skip-crop
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["torch", "torchvision", "onnxruntime", "tesserocr"]
+
+# Alt süreçte çalışan kod: import ve ilk sonuç sürelerini JSON olarak stdout'un son satırına yazar
+CHILD_CODE = """
+import contextlib, json, sys, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(sys.stderr):
+    import main
+    imported = time.perf_counter()
+    mode = {mode!r}
+    if mode != "import":
+        main.SCENARIOS = [s for s in main.SCENARIOS if mode == "crop" or not s[0]]
+        main.run({image!r}, save_results=False)
+done = time.perf_counter()
+print(json.dumps({{"import_s": imported - start, "total_s": done - start,
+                  "heavy_modules": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+# Modu yeni bir süreçte bir kez çalıştırır; süreç başlangıcından bitişe kadar geçen süreyi de ekler
+def run_once(mode, image):
+    code = CHILD_CODE.format(mode=mode, image=image, heavy=HEAVY_MODULES)
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines() or ["no output"]
+        raise RuntimeError(lines[-1])
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["wall_s"] = wall
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import time and time-to-first-result of main.py in fresh processes.")
+    parser.add_argument("--image", default=os.path.join(ROOT_DIR, "receipts", "S1.jpg"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-crop", action="store_true", help="Only measure import and the no-crop scenarios")
+    args = parser.parse_args(argv)
+
+    modes = ["import", "no-crop"] + ([] if args.skip_crop else ["crop"])
+
+    print(f"median of {args.repeat} fresh processes, image {os.path.relpath(args.image, ROOT_DIR)}\n")
+    print(f"{'mode':<10}{'process wall':>14}{'import':>10}{'first result':>14}  heavy modules loaded")
+    for mode in modes:
+        try:
+            runs = [run_once(mode, os.path.abspath(args.image)) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{mode:<10}  failed: {e}")
+            continue
+        wall = statistics.median(r["wall_s"] for r in runs)
+        imported = statistics.median(r["import_s"] for r in runs)
+        total = statistics.median(r["total_s"] for r in runs)
+        heavy = ", ".join(runs[-1]["heavy_modules"]) or "-"
+        first = "-" if mode == "import" else f"{total:>11.2f} s"
+        print(f"{mode:<10}{wall:>12.2f} s{imported:>8.2f} s{first:>14}  {heavy}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
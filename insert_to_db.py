@@ -1,71 +1,279 @@
+# Fiş/fatura görüntülerini OCR'dan geçirip sonuçları veritabanındaki Documents tablosuna yazan toplu yükleme komutu.
+#
+# - OCR worker süreçlerinde yapılır (batch.py ile aynı worker'lar, autocrop modeli worker başına bir kez yüklenir).
+# - Ana süreç yazıcıdır: biten sonuçları toplar, --batch-size satırda veya --flush-seconds saniyede bir (yeni sonuç
+#   gelmese de) tek executemany ve tek commit ile yazar. Yazıcı commit beklerken worker'lar OCR'a devam eder.
+# - Satırlar görüntü içeriğinin SHA-256 hash'i (ImageHash) ile upsert edilir, aynı görüntüyü tekrar yüklemek satır çoğaltmaz.
+#   --skip-existing ile veritabanında zaten olan görüntüler OCR'lanmaz.
+# - MSSQL (pyodbc, fast_executemany) veya test/geliştirme için SQLite (--sqlite) kullanılabilir.
+#
+# MSSQL'de mevcut Documents tablosuna bir kez hash kolonu eklenmelidir:
+#   ALTER TABLE Documents ADD ImageHash CHAR(64) NULL;
+#   CREATE UNIQUE INDEX UX_Documents_ImageHash ON Documents (ImageHash) WHERE ImageHash IS NOT NULL;
+#
+# Örnek:
+#   python insert_to_db.py Karel/receipts -w 8 --batch-size 200
+#   python insert_to_db.py receipts/ --sqlite cache/documents.sqlite --skip-existing
+#   python insert_to_db.py --jsonl results.jsonl --sqlite cache/documents.sqlite   # batch.py çıktısından, OCR yapmadan
+#
+# SQLite yazıcısının upsert ve --skip-existing davranışı test_insert_to_db.py ile kontrol edilir.
+
+import argparse
+import contextlib
+import json
+import multiprocessing
 import os
-import pyodbc
-from main import run
+import sqlite3
+import sys
+import time
+
+with contextlib.redirect_stdout(sys.stderr):
+    from batch import collect_images, init_worker, process_chunk
+    from result_cache import hash_file
 
-conn = pyodbc.connect( #MSSQL Setup
+# MSSQL bağlantısı (OCR_DB_CONNECTION ile değiştirilebilir)
+DEFAULT_CONNECTION = (
     "Driver={ODBC Driver 17 for SQL Server};"
     "Server=localhost\\SQLEXPRESS06;"   #Server name---------------------- CHANGE
     "Database=KarelOCR;"                #Database  ---------------------- CHANGE
     "Trusted_Connection=yes;"
 )
-cursor = conn.cursor()
+DEFAULT_IMAGE_DIR = "Karel/receipts"    #Image directory ---------------------- CHANGE
+
+# Documents tablosuna yazılan kolonlar (ImageHash upsert anahtarıdır)
+COLUMNS = [
+    "DocumentType", "FisNo", "FaturaNo", "BelgeTarihi", "Toplam", "ToplamKDV",
+    "KDVOrani", "TicaretSicilNo", "MersisNo", "ETTN", "ImagePath", "ImageHash",
+]
 
-image_dir = "Karel/receipts"        #Image directory ---------------------- CHANGE
-image_files = [f"S{i}.jpg" for i in range(1, 36)]  #Image names ---------------------- CHANGE
+# Date Fix DD.MM.YYYY → YYYY-MM-DD for SQL
+def sql_date(raw_date, filename=None):
+    if not raw_date:
+        return None
+    try:
+        day, month, year = raw_date.split(".")
+        return f"{year}-{month}-{day}"
+    except ValueError:
+        print(f"Invalid date format in {filename}: {raw_date}", file=sys.stderr)
+        return None
 
-print("Code starts")
+# OCR sonucunu COLUMNS sırasında bir satıra çevirir, Toplam yoksa None döner (satır yazılmaz)
+def document_row(result, path, image_hash):
+    if not result or result.get("Toplam") is None:
+        return None
+    return (
+        "Bill" if "Fatura No" in result else "Receipt",
+        result.get("Fiş No"),
+        result.get("Fatura No"),
+        sql_date(result.get("Tarih"), os.path.basename(path)),
+        result["Toplam"],                     # NOT NULL
+        result.get("Toplam KDV"),
+        result.get("KDV Oranı"),
+        result.get("Ticaret Sicil No"),
+        result.get("Mersis No"),
+        result.get("ETTN"),
+        path.replace("\\", "/"),
+        image_hash,
+    )
 
-for filename in image_files:
-    path = os.path.join(image_dir, filename)
-    print(f"\nProcessing {filename}...")
+# Yazıcıların ortak kısmı: satırları tek executemany ile yazar ve batch başına bir kez commit eder
+class DocumentWriter:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows_written = 0
 
-    try:
-        result = run(path, test=False)
-
-        if not result or "Toplam" not in result:
-            print(f"Skipping {filename} — 'Toplam' missing.")
-            continue
-
-        doc_type = "Bill" if "Fatura No" in result else "Receipt"
-
-        insert_query = """
-        INSERT INTO Documents (
-            DocumentType, FisNo, FaturaNo, BelgeTarihi, Toplam, ToplamKDV,
-            KDVOrani, TicaretSicilNo, MersisNo, ETTN, ImagePath
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        
-        raw_date = result.get("Tarih")         # Date Fix DD.MM.YYYY → YYYY-MM-DD for SQL
-        sql_date = None
-        if raw_date:
-            try:
-                day, month, year = raw_date.split(".")
-                sql_date = f"{year}-{month}-{day}"
-            except Exception as e:
-                print(f"Invalid date format in {filename}: {raw_date}")
-
-        values = (
-            doc_type,
-            result.get("Fiş No"),
-            result.get("Fatura No"),
-            sql_date,
-            result["Toplam"],                     # NOT NULL
-            result.get("Toplam KDV"),
-            result.get("KDV Oranı"),
-            result.get("Ticaret Sicil No"),
-            result.get("Mersis No"),
-            result.get("ETTN"),
-            path.replace("\\", "/")
+    def upsert_sql(self):
+        raise NotImplementedError
+
+    def _cursor(self):
+        return self.conn.cursor()
+
+    def write_batch(self, rows):
+        if not rows:
+            return 0
+        rows = list({row[-1]: row for row in rows}.values())  # Aynı batch'te aynı görüntü varsa sonuncusu yazılır
+        cursor = self._cursor()
+        try:
+            cursor.executemany(self.upsert_sql(), rows)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        self.rows_written += len(rows)
+        return len(rows)
+
+    def existing_hashes(self):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT ImageHash FROM Documents WHERE ImageHash IS NOT NULL")
+            return {row[0] for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+    def close(self):
+        self.conn.close()
+
+# MSSQL yazıcısı: pyodbc'nin fast_executemany'si parametreleri tek seferde gönderir, MERGE ile upsert yapılır
+class MSSQLWriter(DocumentWriter):
+    def __init__(self, connection_string=DEFAULT_CONNECTION):
+        import pyodbc  # Opsiyonel bağımlılık, SQLite ile çalışırken gerekmez
+        super().__init__(pyodbc.connect(connection_string, autocommit=False))
+
+    def _cursor(self):
+        cursor = self.conn.cursor()
+        cursor.fast_executemany = True
+        return cursor
+
+    def upsert_sql(self):
+        source = ", ".join(f"? AS {column}" for column in COLUMNS)
+        updates = ", ".join(f"t.{column} = s.{column}" for column in COLUMNS if column != "ImageHash")
+        return (
+            f"MERGE Documents WITH (HOLDLOCK) AS t USING (SELECT {source}) AS s ON t.ImageHash = s.ImageHash "
+            f"WHEN MATCHED THEN UPDATE SET {updates} "
+            f"WHEN NOT MATCHED THEN INSERT ({', '.join(COLUMNS)}) VALUES ({', '.join('s.' + c for c in COLUMNS)});"
         )
 
-        cursor.execute(insert_query, values)
-        conn.commit()
-        print(f"Inserted {filename} into database.")
+# SQLite yazıcısı: MSSQL olmadan deneme ve test için, tabloyu yoksa oluşturur
+class SQLiteWriter(DocumentWriter):
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        super().__init__(sqlite3.connect(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS Documents ("
+            "Id INTEGER PRIMARY KEY AUTOINCREMENT, DocumentType TEXT, FisNo TEXT, FaturaNo TEXT, BelgeTarihi TEXT, "
+            "Toplam REAL NOT NULL, ToplamKDV REAL, KDVOrani REAL, TicaretSicilNo TEXT, MersisNo TEXT, ETTN TEXT, "
+            "ImagePath TEXT, ImageHash TEXT UNIQUE)"
+        )
+        self.conn.commit()
+
+    def upsert_sql(self):
+        updates = ", ".join(f"{column} = excluded.{column}" for column in COLUMNS if column != "ImageHash")
+        return (
+            f"INSERT INTO Documents ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+            f"ON CONFLICT(ImageHash) DO UPDATE SET {updates}"
+        )
+
+# Worker'da bir grup görüntüyü OCR'lar (bkz. batch.process_chunk) ve her kayda görüntü hash'ini ekler
+def ocr_chunk(paths):
+    records = process_chunk(paths)
+    for record in records:
+        try:
+            record["image_hash"] = hash_file(record["path"])
+        except OSError as e:
+            record.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+    return records
+
+# batch.py çıktısındaki (JSONL) kayıtları okur, OCR tekrar yapılmaz; image_hash yoksa dosyadan hesaplanır
+def read_jsonl(path):
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("status") == "ok" and "image_hash" not in record:
+                try:
+                    record["image_hash"] = hash_file(record["path"])
+                except OSError as e:
+                    record.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+            records.append(record)
+    return records
+
+# Pool.imap sonuçlarını en fazla timeout saniye bekler, süre dolarsa boş grup verir; böylece sonuç gelmese de
+# flush_seconds süresi kontrol edilir. next(timeout) olmayan girdiler (liste) olduğu gibi döner
+def poll_chunks(record_chunks, timeout):
+    next_chunk = getattr(record_chunks, "next", None)
+    if next_chunk is None:
+        yield from record_chunks
+        return
+    while True:
+        try:
+            yield next_chunk(timeout=timeout)
+        except multiprocessing.TimeoutError:
+            yield []
+        except StopIteration:
+            return
+
+# Kayıt gruplarını satırlara çevirip yazıcıya verir: batch_size satırda veya flush_seconds saniyede bir commit
+# (skipped, failed) döndürür
+def ingest(record_chunks, writer, batch_size=100, flush_seconds=30.0):
+    pending, skipped, failed = [], 0, 0
+    last_flush = time.perf_counter()
+    for records in poll_chunks(record_chunks, min(flush_seconds, 1.0)):
+        for record in records:
+            filename = os.path.basename(record["path"])
+            if record["status"] != "ok":
+                failed += 1
+                print(f"Error processing {filename}: {record['error']}", file=sys.stderr)
+                continue
+            row = document_row(record["result"], record["path"], record["image_hash"])
+            if row is None:
+                skipped += 1
+                print(f"Skipping {filename} — 'Toplam' missing.", file=sys.stderr)
+                continue
+            pending.append(row)
+
+        if len(pending) >= batch_size or (pending and time.perf_counter() - last_flush >= flush_seconds):
+            writer.write_batch(pending)
+            pending, last_flush = [], time.perf_counter()
+            print(f"Committed {writer.rows_written} rows", file=sys.stderr)
+    writer.write_batch(pending)
+    return skipped, failed
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="OCR receipt/bill images and upsert the results into the Documents table.")
+    parser.add_argument("source", nargs="?", default=DEFAULT_IMAGE_DIR, help="Image directory or glob pattern")
+    parser.add_argument("--jsonl", default=None, help="Upsert the records of a batch.py output file instead of running OCR")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="Number of OCR worker processes")
+    parser.add_argument("--batch-size", type=int, default=100, help="Rows per executemany/commit")
+    parser.add_argument("--flush-seconds", type=float, default=30.0, help="Commit pending rows at least this often")
+    parser.add_argument("--crop-batch", type=int, default=8, help="Images per batched autocrop forward pass in a worker")
+    parser.add_argument("--agreement", type=int, default=None, help="Early-exit vote margin for required fields (0 or default: run all passes)")
+    parser.add_argument("--backend", default=None, help="OCR backend (pytesseract or tesserocr)")
+    parser.add_argument("--profile", default=None, help="Pass schedule profile name or .json path (see pass_schedule.py)")
+    parser.add_argument("--sqlite", default=None, help="Write to this SQLite file instead of MSSQL")
+    parser.add_argument("--skip-existing", action="store_true", help="Do not OCR (or with --jsonl, write) images whose hash is already in the table")
+    parser.add_argument("--no-warmup", action="store_true", help="Do not preload the autocrop model in workers")
+    args = parser.parse_args(argv)
+    if args.agreement is not None and args.agreement < 0:
+        parser.error("--agreement must be 0 (off) or at least 1")
+    args.agreement = args.agreement or None  # API'deki OCR_AGREEMENT gibi 0 erken çıkışı kapatır
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    writer = SQLiteWriter(args.sqlite) if args.sqlite else MSSQLWriter(os.environ.get("OCR_DB_CONNECTION", DEFAULT_CONNECTION))
+    existing = writer.existing_hashes() if args.skip_existing else set()
+    if args.skip_existing:
+        print(f"Skipping images already in the table: {len(existing)} rows", file=sys.stderr)
+
+    start = time.perf_counter()
+    try:
+        if args.jsonl:
+            records = [r for r in read_jsonl(args.jsonl) if r.get("image_hash") not in existing]
+            print(f"Upserting {len(records)} records from {args.jsonl}", file=sys.stderr)
+            chunks = [records[i:i + args.batch_size] for i in range(0, len(records), args.batch_size)]
+            skipped, failed = ingest(chunks, writer, args.batch_size, args.flush_seconds)
+        else:
+            paths = [path for path in collect_images(args.source) if not existing or hash_file(path) not in existing]
+            print(f"Processing {len(paths)} images with {args.workers} workers", file=sys.stderr)
+            skipped, failed = 0, 0
+            if paths:
+                options = {"agreement": args.agreement, "backend": args.backend, "warmup": not args.no_warmup, "profile": args.profile}
+                crop_batch = max(1, min(args.crop_batch, -(-len(paths) // args.workers)))
+                chunks = [paths[i:i + crop_batch] for i in range(0, len(paths), crop_batch)]
+                with multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(options,)) as pool:
+                    skipped, failed = ingest(pool.imap_unordered(ocr_chunk, chunks), writer, args.batch_size, args.flush_seconds)
+    finally:
+        writer.close()
 
-    except Exception as e:
-        print(f"Error processing {filename}: {e}")
+    elapsed = time.perf_counter() - start
+    print(f"Done: {writer.rows_written} rows upserted, {skipped} skipped, {failed} failed in {elapsed:.1f}s", file=sys.stderr)
+    return 1 if failed else 0
 
-cursor.close()
-conn.close()
 
-print("\n Code ends")
+if __name__ == "__main__":
+    sys.exit(main())
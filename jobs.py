@@ -0,0 +1,106 @@
+# OCR API için sınırlı eşzamanlılığa sahip, bellek içi iş (job) kuyruğu.
+#
+# - İşler sabit sayıda worker thread'inde çalışır (concurrency).
+# - Bekleyen + çalışan iş sayısı concurrency + max_queue'ya ulaşınca yeni işler QueueFullError ile reddedilir (HTTP 429).
+# - Biten işlerin sonuçları ttl saniye boyunca sorgulanabilir, sonra silinir.
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Kuyruk dolu olduğunda fırlatılır
+class QueueFullError(Exception):
+    pass
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"  # queued -> running -> done / failed
+        self.result = None
+        self.report = None
+        self.error = None
+        self.error_type = None  # Başarısız işin istisna sınıfı (traceback tutulmaz); HTTP durum kodunu seçmek için
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        data = {"id": self.id, "status": self.status}
+        if self.status == "done":
+            data["result"] = self.result
+        if self.status == "failed":
+            data["error"] = self.error
+        if self.finished_at:
+            data["seconds"] = round(self.finished_at - (self.started_at or self.created_at), 3)
+        return data
+
+class JobQueue:
+    # handler(*args, **kwargs) -> (result, report) şeklinde çalışan fonksiyon (örn. main.run_with_report)
+    def __init__(self, handler, concurrency=2, max_queue=16, ttl=3600):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ocr-job")
+        self._jobs = {}
+        self._active = 0  # Bekleyen + çalışan işler
+        self._lock = threading.Lock()
+
+    # Kuyruktaki (henüz başlamamış) iş sayısı
+    @property
+    def depth(self):
+        with self._lock:
+            return max(0, self._active - self.concurrency)
+
+    def submit(self, *args, on_finish=None, **kwargs):
+        with self._lock:
+            self._prune()
+            if self._active >= self.concurrency + self.max_queue:
+                raise QueueFullError("OCR queue is full, try again later")
+            job = Job()
+            self._jobs[job.id] = job
+            self._active += 1
+
+        self._executor.submit(self._run, job, args, kwargs, on_finish)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, args, kwargs, on_finish):
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result, job.report = self.handler(*args, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.error_type = type(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._active -= 1
+            job.done.set()
+            # Bekleyenler callback'ten önce uyandırılır; callback hatası işi veya worker'ı etkilemez
+            if on_finish:
+                try:
+                    on_finish(job)
+                except Exception:
+                    logger.exception(f"on_finish callback failed for job {job.id}")
+
+    # Süresi dolmuş bitmiş işleri siler (kilit altında çağrılır)
+    def _prune(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
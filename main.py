@@ -11,51 +11,632 @@
 # - Test modu ile detaylı ara çıktı dosyaları oluşturulur.
 # - Sonuçlar JSON formatında kaydedilir.
 
-from autocrop_kh import autocrop
-from PIL import Image
+from autocrop_kh import autocrop, autocrop_batch, is_whole_frame, reset_peak_rss, peak_rss_mb
+from PIL import Image, ImageOps
 import pytesseract
-import torch
 import os
 import json
+import hashlib
+import io
+import atexit
+import contextlib
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 from processImage import *
 from postProcess import *
+from result_cache import hash_bytes, cache_key, pipeline_config_hash
+from metrics import Trace
+from pass_schedule import load_profile, pass_wins
 
-print(">>> Kod başladı <<<")
+# Tesseract konumu: PATH'te değilse TESSERACT_CMD ile verilir (örn. Windows'ta C:\Program Files\Tesseract-OCR\tesseract.exe)
+if os.environ.get("TESSERACT_CMD"):
+    pytesseract.pytesseract.tesseract_cmd = os.environ["TESSERACT_CMD"]
 
-# Tesseract konumu (kendi Tesseract directory'nizi yazmanız gerekiyor)
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+# OCR backend arayüzü: bir görüntüyü verilen PSM ile metne çevirir
+# key, aynı görüntünün art arda farklı PSM'lerle okunduğunu backend'e bildirmek için kullanılır (görüntü özeti gibi)
+class OCRBackend:
+    name = None
+
+    def __init__(self, lang = "tur", oem = 3):
+        self.lang = lang
+        self.oem = oem
+
+    def image_to_string(self, image, psm, key = None):
+        raise NotImplementedError
+
+    # Kelime kutuları: [{"text", "left", "top", "width", "height", "conf", "line"}, ...] (line: aynı satırdaki kelimelerde aynı)
+    def image_to_data(self, image, psm, key = None):
+        raise NotImplementedError
+
+# pytesseract backend'i: her çağrıda tesseract sürecini başlatır (yedek olarak her zaman kullanılabilir)
+# NumPy dizileri key başına bir kez sıkıştırmasız PNM (PGM/PPM) dosyasına yazılır ve farklı PSM'lerde aynı dosya kullanılır;
+# pytesseract'ın her çağrıda diziyi PIL'e çevirip PNG olarak kodlaması önlenir.
+class PytesseractBackend(OCRBackend):
+    name = "pytesseract"
+    max_files = 32  # Diskte tutulan en fazla görüntü dosyası (kullanımda olmayanlardan en eski kullanılan silinir)
+
+    def __init__(self, lang = "tur", oem = 3):
+        super().__init__(lang, oem)
+        self._files = {}  # key -> [dosya yolu, o an dosyayı okuyan tesseract çağrısı sayısı] (ekleme/kullanım sırasına göre)
+        self._files_lock = threading.Lock()
+        self._tmpdir = None
+
+    # Dosya sayısı limit'i geçmeyene kadar kullanımda olmayan en eski dosyaları siler (kilit altında çağrılır)
+    def _evict(self, limit):
+        idle = [k for k, (_, refs) in self._files.items() if refs == 0]
+        for oldest in idle[:max(0, len(self._files) - limit)]:
+            os.remove(self._files.pop(oldest)[0])
+
+    # Dosyayı kullanıma alır; başka thread'de tesseract'ın okuduğu dosya silinmez, limit o dosya bırakılana kadar aşılabilir
+    def _acquire(self, image, key):
+        with self._files_lock:
+            entry = self._files.pop(key, None)
+            if entry is None:
+                if self._tmpdir is None:
+                    self._tmpdir = tempfile.mkdtemp(prefix="ocr-pnm-")
+                    atexit.register(shutil.rmtree, self._tmpdir, True)
+                path = os.path.join(self._tmpdir, f"{len(self._files)}-{time.monotonic_ns()}.pnm")
+                Image.fromarray(to_uint8(image)).save(path, format="PPM")  # Gri görüntü PGM, RGB görüntü PPM olarak yazılır
+                entry = [path, 0]
+                self._evict(self.max_files - 1)
+            entry[1] += 1
+            self._files[key] = entry
+        return entry[0]
+
+    def _release(self, key):
+        with self._files_lock:
+            entry = self._files.get(key)
+            if entry is not None:
+                entry[1] -= 1
+            self._evict(self.max_files)  # Kullanımdayken silinemeyen dosyalar yüzünden aşılan limite geri döner
+
+    @contextlib.contextmanager
+    def _input(self, image, key):
+        if not isinstance(image, np.ndarray) or key is None:
+            yield image if not isinstance(image, np.ndarray) else convert_to_pil(image)
+            return
+        path = self._acquire(image, key)
+        try:
+            yield path
+        finally:
+            self._release(key)
+
+    def image_to_string(self, image, psm, key = None):
+        custom_config = f'--oem {self.oem} --psm {psm} -l {self.lang}'
+        with self._input(image, key) as source:
+            return pytesseract.image_to_string(source, config=custom_config)
+
+    def image_to_data(self, image, psm, key = None):
+        custom_config = f'--oem {self.oem} --psm {psm} -l {self.lang}'
+        with self._input(image, key) as source:
+            data = pytesseract.image_to_data(source, config=custom_config, output_type=pytesseract.Output.DICT)
+        words = []
+        for i, text in enumerate(data["text"]):
+            if not text.strip():
+                continue
+            words.append({
+                "text": text, "left": data["left"][i], "top": data["top"][i], "width": data["width"][i], "height": data["height"][i],
+                "conf": float(data["conf"][i]), "line": (data["block_num"][i], data["par_num"][i], data["line_num"][i]),
+            })
+        return words
+
+# tesserocr (Tesseract C-API) backend'i: her worker thread'i için bir kez başlatılmış motor tutar,
+# dil verisi (traineddata) tekrar yüklenmez. Aynı görüntü (aynı key) için görüntü bir kez verilir, sadece PSM değiştirilir.
+# NumPy dizilerinin ham pikselleri SetImageBytes ile PNG/PIL kodlaması olmadan verilir. tesserocr bytes beklediği için
+# pikseller bir kez kopyalanır (tobytes); Tesseract da görüntüyü kendi Pix'ine kopyalar.
+class TesserocrBackend(OCRBackend):
+    name = "tesserocr"
+
+    def __init__(self, lang = "tur", oem = 3, tessdata_path = None):
+        super().__init__(lang, oem)
+        import tesserocr  # Opsiyonel bağımlılık, sadece bu backend seçilirse gerekir
+        self._tesserocr = tesserocr
+        self.tessdata_path = tessdata_path
+        self._local = threading.local()
+
+    def _engine(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            kwargs = {"lang": self.lang, "oem": self.oem}
+            if self.tessdata_path:
+                kwargs["path"] = self.tessdata_path
+            api = self._tesserocr.PyTessBaseAPI(**kwargs)
+            self._local.api = api
+            self._local.image_key = None
+        return api
+
+    def _set_image(self, image, psm, key):
+        api = self._engine()
+        api.SetPageSegMode(psm)
+        height, width = image.shape[:2] if isinstance(image, np.ndarray) else (image.height, image.width)
+        if key is None or key != self._local.image_key:
+            if isinstance(image, np.ndarray):
+                pixels = np.ascontiguousarray(to_uint8(image))
+                bpp = 1 if pixels.ndim == 2 else pixels.shape[2]
+                api.SetImageBytes(pixels.tobytes(), width, height, bpp, width * bpp)
+            else:
+                api.SetImage(image)
+            self._local.image_key = key
+        else:
+            api.SetRectangle(0, 0, width, height)  # Önceki tanıma sonucunu temizler, görüntü tekrar yüklenmez
+        return api
+
+    def image_to_string(self, image, psm, key = None):
+        return self._set_image(image, psm, key).GetUTF8Text()
+
+    def image_to_data(self, image, psm, key = None):
+        api = self._set_image(image, psm, key)
+        api.Recognize()
+        RIL = self._tesserocr.RIL
+        words = []
+        line = -1
+        for word in self._tesserocr.iterate_level(api.GetIterator(), RIL.WORD):
+            if word.IsAtBeginningOf(RIL.TEXTLINE):
+                line += 1
+            text = word.GetUTF8Text(RIL.WORD)
+            box = word.BoundingBox(RIL.WORD)
+            if not text or not text.strip() or box is None:
+                continue
+            x1, y1, x2, y2 = box
+            words.append({"text": text, "left": x1, "top": y1, "width": x2 - x1, "height": y2 - y1,
+                          "conf": word.Confidence(RIL.WORD), "line": line})
+        return words
+
+OCR_BACKENDS = {
+    PytesseractBackend.name: PytesseractBackend,
+    TesserocrBackend.name: TesserocrBackend,
+}
+
+_ocr_backend = None
+
+# İsme göre OCR backend'i oluşturur; tesserocr kurulu değilse pytesseract'a geri döner
+def create_ocr_backend(name = None):
+    name = name or os.environ.get("OCR_BACKEND", PytesseractBackend.name)
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend: {name}. Supported backends are {', '.join(OCR_BACKENDS)}")
+    try:
+        return OCR_BACKENDS[name]()
+    except ImportError:
+        print(f"OCR backend '{name}' is not available, falling back to pytesseract")
+        return PytesseractBackend()
+
+# Süreç genelinde kullanılan OCR backend'ini döndürür (ilk kullanımda OCR_BACKEND ortam değişkenine göre oluşturulur)
+def get_ocr_backend():
+    global _ocr_backend
+    if _ocr_backend is None:
+        _ocr_backend = create_ocr_backend()
+    return _ocr_backend
+
+# Süreç genelinde kullanılacak OCR backend'ini değiştirir (isim veya OCRBackend nesnesi)
+def set_ocr_backend(backend):
+    global _ocr_backend
+    _ocr_backend = create_ocr_backend(backend) if isinstance(backend, str) else backend
+    return _ocr_backend
 
 # PIL Image nesnesinden OCR ile metin çıkarır
 # config_psm parametresi ile Tesseract'ın Sayfa Segmentasyon Modu ayarlanabilir
-def extract_text_from_image(image, config_psm = 6):
-    custom_config = f'--oem 3 --psm {config_psm} -l tur'
-    text = pytesseract.image_to_string(image, config=custom_config)
+def extract_text_from_image(image, config_psm = 6, backend = None, key = None):
+    backend = backend or get_ocr_backend()
+    text = backend.image_to_string(image, config_psm, key=key)
     return text
 
-# Makbuz/fatura iş akışını çalıştırır:
+# OCR işini çalıştırır, sonucu süresiyle birlikte döndürür (executor worker'larında da çalışır)
+def timed_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+# Executor worker'larında çalışan tek OCR geçişi (process pool için modül seviyesinde tanımlı olmalı)
+def ocr_pass(image, psm, key = None):
+    return extract_text_from_image(image, psm, key=key)
+
+# Process pool worker'ı başlarken ana süreçteki OCR backend'ini seçer, motor worker başına bir kez oluşturulur
+def init_ocr_worker(backend_name):
+    set_ocr_backend(backend_name)
+
+# Bir fişin OCR geçişlerini paralel çalıştıracak executor'u oluşturur:
+# - thread: pytesseract için (asıl iş tesseract alt sürecinde yapılır),
+# - process: tesserocr gibi CPU'yu süreç içinde kullanan backend'ler için (görüntüler worker'lara kopyalanır).
+# kind verilmezse aktif backend'e göre seçilir, workers verilmezse CPU sayısı kadar worker açılır.
+def create_pass_executor(kind = None, workers = None):
+    backend = get_ocr_backend()
+    if kind is None:
+        kind = "process" if isinstance(backend, TesserocrBackend) else "thread"
+    workers = workers or os.cpu_count() or 1
+
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr-pass")
+    elif kind == "process":
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_ocr_worker, initargs=(backend.name,))
+    else:
+        raise ValueError("Unsupported executor kind. Supported kinds are thread and process")
+
+# İşlem senaryoları (crop, pre_process) ve her senaryoda denenen PSM değerleri, sıralama sonuç indekslemesi için önemli
+SCENARIOS = [(False, False), (False, True), (True, False), (True, True)]
+PSM_VALUES = [11, 4, 6, 3]
+
+# Varsayılan olarak kullanılacak geçiş planı (bkz. pass_schedule.py), boşsa tüm senaryo x PSM geçişleri çalışır
+PASS_PROFILE = os.environ.get("OCR_PASS_PROFILE") or None
+
+# Tüm senaryo x PSM geçişleri, varsayılan sırayla
+def default_passes():
+    return [(crop, pre_process, value) for crop, pre_process in SCENARIOS for value in PSM_VALUES]
+
+# Profil ismi/yolu veya geçiş listesinden (crop, pre_process, psm) listesi; None ise PASS_PROFILE veya varsayılan plan
+def resolve_passes(profile = None):
+    profile = profile or PASS_PROFILE
+    if profile is None:
+        return default_passes()
+    if isinstance(profile, str):
+        return load_profile(profile)
+    return [tuple(p) for p in profile]
+
+# Autocrop'un bulduğu sayfa köşeleri görüntü köşelerine bu oranda (kenar uzunluğuna göre) yakınsa tüm kare döndürülmüş kabul edilir
+WHOLE_FRAME_TOLERANCE = 0.02
+
+# Görüntü kaynağını (dosya yolu, byte dizisi, RGB NumPy dizisi veya PIL Image) açar
+# Byte ve dizi girdileri diske yazılmadan doğrudan bellekte decode edilir
+# Piksel sınırını aşan görüntüler decode edilmeden reddedilir (bkz. processImage.check_image_size)
+def load_image(source):
+    if isinstance(source, np.ndarray):
+        check_image_size(source.shape[1], source.shape[0])
+        return convert_to_pil(source)
+    if isinstance(source, Image.Image):
+        image = source
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(source))
+    else:
+        image = Image.open(source)
+    check_image_size(*image.size)
+    return image
+
+# Görüntü kaynağının byte'larının hash'i (önbellek ve OCR deposu anahtarı için)
+def source_hash(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hash_bytes(bytes(source))
+    if isinstance(source, np.ndarray):
+        return hash_bytes(f"{source.shape}:{source.dtype}".encode() + source.tobytes())
+    if isinstance(source, Image.Image):
+        return hash_bytes(f"{source.mode}:{source.size}".encode() + source.tobytes())
+    with open(source, "rb") as f:
+        return hash_bytes(f.read())
+
+# Görüntünün içeriğine göre özet (hash) üretir, aynı girdiye sahip senaryoları tespit etmek için kullanılır
+# (NumPy dizisi veya PIL Image)
+def image_digest(image):
+    if isinstance(image, np.ndarray):
+        h = hashlib.sha1(np.ascontiguousarray(image).tobytes())
+        h.update(f"{image.dtype}:{image.shape}".encode())
+        return h.hexdigest()
+    h = hashlib.sha1(image.tobytes())
+    h.update(f"{image.mode}:{image.size}".encode())
+    return h.hexdigest()
+
+# Bir görüntü için senaryo girdilerini hesaplayan küçük aşama grafiği:
+# - Dosya yalnızca bir kez decode edilir,
+# - Autocrop yalnızca bir kez çalışır (senaryo 3 ve 4 aynı kırpılmış görüntüyü kullanır),
+# - Her kaynak görüntü yalnızca bir kez ön işlemden geçer,
+# - Girdisi byte bazında aynı olan senaryoların OCR çıktıları tekrar hesaplanmaz.
+# Executor verilirse OCR geçişleri submit() ile önceden sıraya alınıp paralel çalıştırılabilir; sonuçlar yine text() ile
+# istenen sırada okunduğu için birleştirme sırası deterministik kalır.
+# store verilirse (bkz. ocr_store.py) her geçişin ham OCR metni image_hash ile kalıcı olarak kaydedilir.
+# image_path yerine byte dizisi, NumPy dizisi veya PIL Image da verilebilir (bkz. load_image).
+# Decode sonrası tüm aşamalar uint8 NumPy dizileri (RGB veya gri) üzerinde çalışır, OCR backend'leri de diziyi doğrudan alır.
+class ScenarioGraph:
+    def __init__(self, image_path, executor = None, store = None, image_hash = None):
+        self.image_path = image_path
+        self.executor = executor
+        self.store = store
+        self.image_hash = image_hash
+        self._stages = {}
+        self._preprocessed = {}
+        self._texts = {}
+        self._recorded = set()
+        self._unsaved = {}  # Depoya henüz yazılmamış metinler, çalıştırma sonunda tek transaction'da yazılır (bkz. flush_store)
+        self._uncounted = {}  # Sonucu henüz okunmamış OCR işleri: anahtar -> (crop, pre_process, çağrı sayısı, piksel sayısı)
+        self.ocr_calls = 0
+        self.ocr_pixels = 0  # OCR'a verilen toplam piksel sayısı
+        self.baseline_pixels = 0  # Çözünürlük normalizasyonu olmasaydı OCR'a verilecek piksel sayısı
+        self.ocr_seconds = 0.0  # Tamamlanan OCR geçişlerinin toplam süresi
+        self.normalize_seconds = 0.0
+        self.normalize_info = {}  # Kaynak görüntü (kırpılmış/kırpılmamış) -> {"text_height", "scale"}
+        self.crop_stats = None  # Kırpma bu grafikte yapıldıysa süresi ve tepe bellek (RSS) kullanımı
+        self.trace = Trace()  # Aşama süreleri (decode, crop, normalize, preprocess, her OCR geçişi), bkz. metrics.Trace
+
+    def _stage(self, name, compute):
+        if name not in self._stages:
+            self._stages[name] = compute()
+        return self._stages[name]
+
+    # Decode edilmiş RGB görüntü (PIL, EXIF bilgisi için tutulur)
+    def decoded_image(self):
+        return self._stage("decoded_image", lambda: load_image(self.image_path).convert("RGB"))
+
+    # Decode edilmiş RGB görüntü (uint8 NumPy dizisi)
+    def decoded(self):
+        return self._stage("decoded", self._decode)
+
+    def _decode(self):
+        source = self.image_path
+        with self.trace.span("decode"):
+            if isinstance(source, np.ndarray) and source.ndim == 3 and source.shape[2] == 3:  # Dizi girdisi PIL'e çevrilmez
+                check_image_size(source.shape[1], source.shape[0])
+                return to_uint8(source)
+            return np.asarray(self.decoded_image())
+
+    # Autocrop ile kırpılmış görüntü; model tüm kareyi döndürdüyse kırpılmamış görüntü kullanılır
+    def cropped(self):
+        return self._stage("cropped", self._crop)
+
+    def _crop(self):
+        source = self.crop_source()
+        self.crop_stats = {}
+        with self.trace.span("crop"):
+            cropped_array, corners = autocrop(np_image=source, model_path=MODEL_PATH, device=get_device(),
+                                              low_memory=LOW_MEMORY_CROP, stats=self.crop_stats, return_corners=True)
+            return self._crop_result(source, cropped_array, corners)
+
+    # Autocrop'a girecek görüntü (cv2.imread gibi EXIF yönü uygulanmış)
+    def crop_source(self):
+        if isinstance(self.image_path, np.ndarray):  # Dizilerde EXIF bilgisi yoktur
+            return self.decoded()
+        def compute():
+            image = self.decoded_image()
+            with self.trace.span("decode"):
+                return np.asarray(ImageOps.exif_transpose(image))
+        return self._stage("crop_source", compute)
+
+    # Dışarıda (örn. prefetch_crops ile toplu olarak) kırpılmış görüntüyü bu grafiğin kırpma sonucu olarak kaydeder
+    def set_cropped(self, cropped_array, corners):
+        self._stages["cropped"] = self._crop_result(self.crop_source(), cropped_array, corners)
+
+    # Sayfa köşeleri görüntü köşelerindeyse kırpılmamış görüntü kullanılır. Çıktı boyutuna bakılmaz: kareyi dolduran
+    # eğik bir sayfa aynı boyutta ama perspektifi düzeltilmiş olarak döner ve o düzeltme korunmalıdır.
+    def _crop_result(self, source, cropped_array, corners):
+        if is_whole_frame(corners, source.shape[0], source.shape[1], WHOLE_FRAME_TOLERANCE):
+            return source
+        return to_uint8(cropped_array)
+
+    # Verilen görüntünün özetini döndürür (görüntü başına bir kez hesaplanır)
+    def digest(self, image):
+        key = ("digest", id(image))
+        return self._stage(key, lambda: image_digest(image))
+
+    # Senaryonun OCR'a girecek görüntüsü
+    def scenario_image(self, crop, pre_process):
+        image = self.cropped() if crop else self.decoded()
+        if NORMALIZE_RESOLUTION:
+            image = self.normalized(image, "cropped" if crop else "page")
+        if pre_process:
+            source_digest = self.digest(image)
+            if source_digest not in self._preprocessed:
+                with self.trace.span("preprocess", crop=crop):
+                    self._preprocessed[source_digest] = preprocess_array(image, upscale=not NORMALIZE_RESOLUTION)
+            image = self._preprocessed[source_digest]
+        return image
+
+    # Metin yüksekliğine göre yeniden ölçeklenmiş görüntü (bkz. processImage.normalize_resolution), kaynak başına bir kez
+    def normalized(self, image, name):
+        def compute():
+            start = time.perf_counter()
+            result, info = normalize_resolution(image)
+            self.normalize_seconds += time.perf_counter() - start
+            self.trace.add("normalize", time.perf_counter() - start, start, source=name)
+            self.normalize_info[name] = info
+            return result
+        return self._stage(("normalized", self.digest(image)), compute)
+
+    # Normalizasyon olmasaydı senaryonun OCR girdisinin alanı / şimdiki alanı
+    def _area_factor(self, crop, pre_process):
+        if not NORMALIZE_RESOLUTION:
+            return 1.0
+        source = self.cropped() if crop else self.decoded()
+        image = self.scenario_image(crop, pre_process)
+        baseline = source.shape[0] * source.shape[1]
+        if pre_process and min(source.shape[:2]) < UPSCALE_MIN_SIDE:  # Eski akışta ön işleme 2 kat büyütüyordu
+            baseline *= 4
+        return baseline / (image.shape[0] * image.shape[1])
+
+    def _count(self, crop, pre_process, calls, pixels):
+        self.ocr_calls += calls
+        self.ocr_pixels += pixels
+        self.baseline_pixels += pixels * self._area_factor(crop, pre_process)
+
+    # Senaryo ve PSM için OCR işi: (anahtar, fonksiyon, argümanlar, Tesseract çağrı sayısı, piksel sayısı)
+    # Aynı anahtarlı geçişlerin OCR'ı bir kez yapılır; fonksiyon executor'a da aynen gönderilir
+    def _ocr_task(self, crop, pre_process, psm):
+        image = self.scenario_image(crop, pre_process)
+        key = (self.digest(image), psm)
+        return key, ocr_pass, (image, psm, key[0]), 1, image.shape[0] * image.shape[1]
+
+    # OCR geçişini executor'a gönderir (executor yoksa hiçbir şey yapmaz, OCR text() çağrıldığında yapılır)
+    def submit(self, crop, pre_process, psm):
+        if self.executor is None:
+            return
+        key, func, args, calls, pixels = self._ocr_task(crop, pre_process, psm)
+        if key not in self._texts:
+            self._texts[key] = self.executor.submit(timed_call, func, *args)
+            self._uncounted[key] = (crop, pre_process, calls, pixels)  # İptal edilebilir, sonucu okununca sayılır
+
+    # Senaryo ve PSM için OCR metni; aynı girdi ve PSM için OCR bir kez çalışır
+    def text(self, crop, pre_process, psm):
+        key, func, args, calls, pixels = self._ocr_task(crop, pre_process, psm)
+        if key not in self._texts:
+            if self.executor is None:
+                self._texts[key] = timed_call(func, *args)
+                self._uncounted[key] = (crop, pre_process, calls, pixels)
+            else:
+                self.submit(crop, pre_process, psm)
+        text = self._texts[key]
+        if isinstance(text, Future):
+            text = text.result()
+        if isinstance(text, tuple):  # İlk okumada süre sayılır, sonraki okumalar için sadece metin saklanır
+            text, seconds = text
+            self._texts[key] = text
+            self._count(*self._uncounted.pop(key))
+            self.ocr_seconds += seconds
+            self.trace.add("ocr", seconds, crop=crop, pre_process=pre_process, psm=psm)
+
+        if self.store is not None and (crop, pre_process, psm) not in self._recorded:
+            self._unsaved[(crop, pre_process, psm)] = text
+            self._recorded.add((crop, pre_process, psm))
+        return text
+
+    # Bu çalıştırmada okunan metinleri OCR deposuna yazar (geçiş başına ayrı commit yerine görüntü başına bir commit)
+    def flush_store(self):
+        if self.store is not None and self._unsaved:
+            self.store.put_many(self.image_hash, self._unsaved, get_ocr_backend().name)
+        self._unsaved = {}
+
+    # Erken çıkıştan sonra henüz başlamamış OCR geçişlerini iptal eder; iptal edilemeyenler (çalışmış/çalışan) sayılır
+    def cancel_pending(self):
+        for key, text in self._texts.items():
+            if isinstance(text, Future) and not text.cancel() and key in self._uncounted:
+                self._count(*self._uncounted.pop(key))
+
+# ROI modunda anahtar satırların bulunduğu tam sayfa OCR geçişinin PSM'i ve bölgelere üstten/alttan eklenen pay (satır yüksekliği oranı)
+ROI_ANCHOR_PSM = 6
+ROI_PADDING = 0.6
+ROI_STRIP_GAP = 24  # Birleştirilen şeritler arasındaki boşluk (kaynak görüntü pikseli)
+
+# Kelime kutularını satırlara toplar: [(satır metni, (x0, y0, x1, y1)), ...] (Tesseract okuma sırasıyla)
+def group_lines(words):
+    lines = {}
+    for word in words:
+        x0, y0 = word["left"], word["top"]
+        x1, y1 = x0 + word["width"], y0 + word["height"]
+        if word["line"] not in lines:
+            lines[word["line"]] = [[word["text"]], [x0, y0, x1, y1]]
+        else:
+            texts, box = lines[word["line"]]
+            texts.append(word["text"])
+            box[:] = [min(box[0], x0), min(box[1], y0), max(box[2], x1), max(box[3], y1)]
+    return [(" ".join(texts), tuple(box)) for texts, box in lines.values()]
+
+# Alan anahtarı içeren satırlardan (ve değerin alt satırlarda olabildiği alanlarda sonraki satırlardan) tam genişlikte
+# yatay şeritler oluşturur, çakışan şeritleri birleştirir: [(y0, y1), ...] yukarıdan aşağıya
+def find_roi_strips(lines, height, padding = ROI_PADDING):
+    strips = []
+    for i, (text, box) in enumerate(lines):
+        fields = roi_anchor_fields(text)
+        if not fields:
+            continue
+        following = max(ROI_ANCHOR_PATTERNS[field][1] for field in fields)
+        last_box = lines[min(i + following, len(lines) - 1)][1]
+        pad = int((box[3] - box[1]) * padding)
+        strips.append((max(0, min(box[1], last_box[1]) - pad), min(height, max(box[3], last_box[3]) + pad)))
+
+    merged = []
+    for y0, y1 in sorted(strips):
+        if merged and y0 <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], y1))
+        else:
+            merged.append((y0, y1))
+    return merged
+
+# Şeritleri aralarında boş (beyaz) ayraç bırakarak alt alta tek görüntüde birleştirir; her geçiş tek Tesseract çağrısı olur
+# (pytesseract'ta her çağrı yeni süreç ve dil verisi yüklemesi demektir). Ayraç, şeritlerin satırlarının birleşmesini önler.
+def stack_strips(regions, gap):
+    separator = np.full((gap,) + regions[0].shape[1:], 255, dtype=regions[0].dtype)
+    parts = []
+    for region in regions:
+        if parts:
+            parts.append(separator)
+        parts.append(region)
+    return np.concatenate(parts)
+
+# ScenarioGraph'ın ROI versiyonu: her kaynak görüntü (kırpılmış/kırpılmamış) için bir kez tam sayfa image_to_data
+# yapılır, alan anahtarı içeren satırlar bulunur ve senaryo geçişlerinde sadece bu satırların şeritleri OCR'lanır.
+# Şeritler alt alta tek görüntüde birleştirilip geçiş başına tek çağrıyla OCR'lanır (bkz. stack_strips);
+# text() bu metni döndürür, böylece oylama ve erken çıkış tam sayfa moduyla aynı çalışır.
+# Hiç anahtar satır bulunamazsa o kaynak için tam sayfa OCR yapılır.
+class RegionGraph(ScenarioGraph):
+    # Kaynak görüntünün satırları (tam sayfa tek image_to_data geçişi)
+    def lines(self, crop):
+        def compute():
+            image = self.scenario_image(crop, False)
+            words, seconds = timed_call(get_ocr_backend().image_to_data, image, ROI_ANCHOR_PSM, self.digest(image))
+            self.ocr_seconds += seconds
+            self.trace.add("ocr", seconds, crop=crop, pre_process=False, psm=ROI_ANCHOR_PSM, page=True)
+            self._count(crop, False, 1, image.shape[0] * image.shape[1])
+            return group_lines(words)
+        return self._stage(("lines", crop), compute)
+
+    # Tam sayfa geçişin metni (belge türü tahmini ve alt kalemler için)
+    def page_text(self, crop):
+        return "\n".join(text for text, box in self.lines(crop))
+
+    # Satırları okunmuş kaynaklar (alt kalemler bu kaynakların tam sayfa metinlerinden çıkarılır)
+    def page_sources(self):
+        return [crop for crop in (False, True) if ("lines", crop) in self._stages]
+
+    def strips(self, crop):
+        return self._stage(("strips", crop), lambda: find_roi_strips(self.lines(crop), self.scenario_image(crop, False).shape[0]))
+
+    def _ocr_task(self, crop, pre_process, psm):
+        strips = self.strips(crop)
+        if not strips:
+            return super()._ocr_task(crop, pre_process, psm)
+
+        image = self.scenario_image(crop, pre_process)
+        stacked = self._stage(("roi_image", crop, pre_process), lambda: self._stack(crop, image, strips))
+        key = (self.digest(image), psm, "roi")
+        return key, ocr_pass, (stacked, psm, f"{key[0]}:roi"), 1, stacked.shape[0] * stacked.shape[1]
+
+    # Senaryo görüntüsünün şeritleri tek görüntüde, senaryo başına bir kez (tüm PSM'ler aynı görüntüyü okur)
+    def _stack(self, crop, image, strips):
+        scale = image.shape[0] / self.scenario_image(crop, False).shape[0]  # Ön işleme görüntüyü büyütmüş olabilir
+        regions = [image[int(y0 * scale):int(y1 * scale)] for y0, y1 in strips]
+        return stack_strips(regions, max(1, int(ROI_STRIP_GAP * scale)))
+
+# Hata mesajları için görüntü kaynağının kısa tanımı
+def describe_source(source):
+    if isinstance(source, (str, os.PathLike)):
+        return str(source)
+    return f"in-memory {type(source).__name__} image"
+
+# ScenarioGraph'ın replay versiyonu: görüntü işleme ve OCR yapmaz, metinleri OCR deposundan okur
+class ReplayGraph:
+    def __init__(self, texts, image_path = None):
+        self.image_path = image_path
+        self._texts = texts
+        self.ocr_calls = 0
+        self.ocr_pixels = 0
+        self.ocr_seconds = 0.0
+        self.trace = Trace()
+
+    def submit(self, crop, pre_process, psm):
+        pass
+
+    def text(self, crop, pre_process, psm):
+        if (crop, pre_process, psm) not in self._texts:
+            raise LookupError(f"No stored OCR text for {describe_source(self.image_path)} (crop={crop}, pre_process={pre_process}, psm={psm}), run it once without replay")
+        return self._texts[(crop, pre_process, psm)]
+
+    def cancel_pending(self):
+        pass
+
+    def flush_store(self):
+        pass
+
+# Makbuz/fatura iş akışını çalıştırır (image_path dosya yolu, byte dizisi, NumPy dizisi veya PIL Image olabilir):
 # - İstenirse kırpma (crop) yapılır,
 # - İstenirse OCR öncesi ön işleme yapılır,
 # - Farklı PSM modlarında OCR yapılır,
 # - Çıkarılan metin alanları regex ile analiz edilir,
 # - Alt kalemler çıkarılır (sadece makbuzlar için),
 # - Test aktifse OCR çıktıları dosyaya kaydedilir.
-def run_receipt_pipeline(image_path, test_active = False, crop = True, pre_process = False, psm_values = [11, 4, 6, 3], isReceipt = False):
+# Birden fazla senaryo aynı görüntü için çalışacaksa ortak bir ScenarioGraph verilerek ara aşamalar paylaşılır.
+def run_receipt_pipeline(image_path, test_active = False, crop = True, pre_process = False, psm_values = [11, 4, 6, 3], isReceipt = False, graph = None):
 
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    model_path = os.path.join(current_dir, "models", "autocrop_model_v2.pth")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-
-    if crop:                                                # 1. Kırp
-        cropped_array = autocrop(img_path=image_path, model_path=model_path, device=device)
-        cropped_img = convert_to_pil(cropped_array)         # 2. Görüntüyü uygun formata çevir
-    else:
-        cropped_img = Image.open(image_path).convert("RGB")  # Croplamıyorsak dümdüz açıyoruz
-
-    if pre_process:
-        cropped_img = preprocess_for_ocr(cropped_img)   # Yeni: OCR öncesi preprocess et
 
-    psm_results = []                                    
-    component_results = []                             
+    if graph is None:
+        graph = ScenarioGraph(image_path)
 
     if test_active: # Test aktif ise sonuçları kaydet
         output_folder = os.path.join(current_dir, "ocr_outputs")      
@@ -63,11 +644,15 @@ def run_receipt_pipeline(image_path, test_active = False, crop = True, pre_proce
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
 
-    for value in psm_values:
-        text = extract_text_from_image(cropped_img, value)      # 3. OCR işlemi (signature'deki psm_values ile tek tek)
-        psm_results.append(extract_fields(text, isReceipt))                # 4. Alanları regex ile ayıkla 
-        if value != 11 and isReceipt: component_results.append(parse_items(text, test_active))       # Alt kalemleri çıkar ve ekle, 11 alt kalem için kötü
-        if test_active:
+    texts = [graph.text(crop, pre_process, value) for value in psm_values]  # 1-3. Kırp, ön işle ve OCR yap (signature'deki psm_values ile tek tek)
+
+    # 4. Alanları regex ile ayıkla ve alt kalemleri çıkar (sadece fişler için, 11 alt kalem için kötü)
+    with graph.trace.span("extract"):
+        psm_results, items = extract_batch(texts, isReceipt, [value != 11 for value in psm_values], test_active)
+    component_results = [item_list for item_list in items if item_list is not None]
+
+    if test_active:
+        for value, text in zip(psm_values, texts):
             iteration = (int(crop) * 2) + int(pre_process) + 1
             filename = f"output_ite_{iteration}_psm_{value}.txt"
             
@@ -76,7 +661,14 @@ def run_receipt_pipeline(image_path, test_active = False, crop = True, pre_proce
                 
     return psm_results, component_results
 
-# Verilen görüntü dosyası için tüm senaryoları çalıştırır:
+# Planın ilk geçişlerinin (varsayılan planda kırpılmamış ve işlenmemiş görüntünün tüm PSM'leri) OCR çıktılarına göre
+# belge türünü tahmin eder (fiş ise True). Bu OCR metinleri graph içinde saklanır ve aynı geçişlerde tekrar kullanılır
+def classify_document(graph, passes = None):
+    passes = passes or default_passes()
+    texts = [graph.text(*p) for p in passes[:len(PSM_VALUES)]]
+    return any(is_receipt(text) for text in texts)
+
+# Verilen görüntü için tüm senaryoları çalıştırır (image_path dosya yolu veya bellekteki görüntü: byte, NumPy, PIL):
 # - OCR çıktısına göre belge türünü tahmin eder (fiş veya fatura),
 # - Kırpma ve ön işleme kombinasyonlarını dener,
 # - Tüm PSM değerlerinde OCR yapar,
@@ -85,58 +677,186 @@ def run_receipt_pipeline(image_path, test_active = False, crop = True, pre_proce
 # - Alt kalemleri en iyi toplam tutara göre seçer veya en sık tekrar edenleri bulur,
 # - Test modundaysa detaylı çıktı verir,
 # - Sonuçları JSON olarak results.txt'ye kaydeder.
-def run(image_path, test=False):
+# agreement verilirse zorunlu alanların hepsi bu oy farkıyla kararlı hale geldiğinde kalan geçişler atlanır (erken çıkış).
+# executor verilirse (bkz. create_pass_executor) OCR geçişleri paralel çalışır, sonuçlar yine aynı sırayla birleştirilir.
+# save_results False ise results.txt yazılmaz (batch işlerinde paralel çalışan worker'lar birbirinin dosyasını ezmesin diye)
+# cache verilirse (bkz. result_cache.py) aynı görüntü ve yapılandırma için önceki sonuç OCR yapılmadan döndürülür
+# store verilirse (bkz. ocr_store.py) ham OCR metinleri kaydedilir; replay True ise görüntü işleme ve OCR atlanır,
+# alan çıkarımı, oylama ve alt kalem seçimi kayıtlı metinler üzerinden yeniden yapılır
+# roi True ise tam sayfa geçişler yerine sadece alan anahtarı içeren satırlar OCR'lanır (bkz. RegionGraph)
+# profile verilirse (isim, profiles/*.json yolu veya geçiş listesi) sadece o plandaki geçişler o sırayla çalışır (bkz. pass_schedule.py)
+def run(image_path, test=False, agreement=None, executor=None, save_results=True, cache=None, store=None, replay=False, roi=False, profile=None):
+    final_results, report = run_with_report(image_path, test, agreement, executor, save_results=save_results, cache=cache, store=store, replay=replay, roi=roi, profile=profile)
+    return final_results
+
+# Birden fazla görüntünün autocrop'unu tek seferde (batch_size görüntü başına bir model çalıştırması) yapar
+# ve sonuçları grafiklere kaydeder. Açılamayan görüntüler atlanır, hataları kendi run_with_report çağrılarında görülür.
+def prefetch_crops(graphs, batch_size=16, workers=None):
+    pending, sources = [], []
+    for graph in graphs:
+        if "cropped" in graph._stages:
+            continue
+        try:
+            sources.append(graph.crop_source())
+        except Exception:
+            continue
+        pending.append(graph)
+
+    if not pending:
+        return
+    reset_peak_rss()
+    cropped = autocrop_batch(sources, model_path=MODEL_PATH, device=get_device(), batch_size=batch_size, workers=workers,
+                             low_memory=LOW_MEMORY_CROP, return_corners=True)
+    crop_stats = {"peak_rss_mb": peak_rss_mb(), "batch": len(pending)}  # Tepe bellek tüm grubun kırpmasına aittir
+    for graph, (cropped_array, corners) in zip(pending, cropped):
+        graph.set_cropped(cropped_array, corners)
+        graph.crop_stats = crop_stats
+
+# run() ile aynı işi yapar, sonuçların yanında isteğin kaç OCR geçişi kullandığını gösteren bir rapor da döndürür
+# lookahead: executor varken sonucu beklenen geçişin ötesinde en fazla kaç geçişin önceden gönderileceği
+# (erken çıkış kapalıysa tüm geçişler baştan gönderilir)
+# graph: image_path için önceden oluşturulmuş ScenarioGraph (örn. kırpması prefetch_crops ile toplu yapılmış)
+# roi modunda şerit metinleri OCR deposuna kaydedilmez (tam sayfa metinlerle karışmasın diye), replay ile birlikte kullanılamaz
+# record_wins True ise rapora her alan değerini ve seçilen alt kalem listesini hangi geçişlerin ürettiği eklenir ("wins")
+def run_with_report(image_path, test=False, agreement=None, executor=None, lookahead=None, save_results=True, cache=None, store=None, replay=False, graph=None, roi=False, profile=None, record_wins=False):
+    start = time.perf_counter()
     all_results = []  
     all_components = []
+    component_passes = []  # all_components ile aynı sırada, listeyi üreten geçiş
 
-    isReceipt = is_receipt(extract_text_from_image(image_path, 3)) | is_receipt(extract_text_from_image(image_path, 6)) | is_receipt(extract_text_from_image(image_path, 4)) | is_receipt(extract_text_from_image(image_path, 11))
-    if test: print(f"This is a receipt: {isReceipt}")
+    passes = resolve_passes(profile)
+    custom_passes = passes != default_passes()
 
-    # Dört farklı işlem senaryosunu çalıştırıp sonuçları biriktir
-    psm_results_1, component_results_1 = run_receipt_pipeline(image_path, test, False, False, isReceipt= isReceipt)  # Uncropped, unprocessed
-    all_results.extend(psm_results_1)
-    if isReceipt: all_components.extend(component_results_1)
+    # Önbellek test ve replay modunda kullanılmaz, bu modlar sonuçları her seferinde yeniden üretmeli
+    use_cache = cache is not None and not test and not replay
 
-    psm_results_2, component_results_2 = run_receipt_pipeline(image_path, test, False, True, isReceipt= isReceipt)   # Uncropped, processed
-    all_results.extend(psm_results_2)
-    if isReceipt: all_components.extend(component_results_2)
+    image_hash = None
+    if use_cache or store is not None:
+        image_hash = source_hash(image_path)
 
-    psm_results_3, component_results_3 = run_receipt_pipeline(image_path, test, True, False, isReceipt= isReceipt)   # Cropped, unprocessed
-    all_results.extend(psm_results_3)
-    if isReceipt: all_components.extend(component_results_3) 
+    if replay and store is None:
+        raise ValueError("Replay mode requires an OCR text store")
 
-    psm_results_4, component_results_4 = run_receipt_pipeline(image_path, test, True, True, isReceipt= isReceipt)    # Cropped, processed (skip if bad)
-    all_results.extend(psm_results_4)
-    if isReceipt: all_components.extend(component_results_4)
-    
-    final_results = merge_field_results(all_results)
+    if replay and roi:
+        raise ValueError("ROI mode cannot be replayed, stored texts are full-page OCR outputs")
+
+    if roi:
+        store = None
 
-    # Gerekli alanları kontrol et, yoksa None ata
+    entry_key = None
+    if use_cache:
+        config_hash = pipeline_config_hash(PSM_VALUES, SCENARIOS, agreement, MODEL_PATH, get_ocr_backend().name, roi,
+                                           normalize_settings() if NORMALIZE_RESOLUTION else False,
+                                           passes if custom_passes else None,
+                                           PREPROCESS_CHAIN if PREPROCESS_CHAIN != DEFAULT_PREPROCESS_CHAIN else None,
+                                           LOW_MEMORY_CROP)
+        entry_key = cache_key(image_hash, config_hash)
+
+        final_results = cache.get(entry_key)
+        if final_results is not None:
+            if save_results: save_final_results(final_results)
+            return final_results, {"passes_used": 0, "passes_total": len(passes), "ocr_calls": 0, "cache": "hit",
+                                   "timings": {"total": round((time.perf_counter() - start) * 1000, 2)}}
+
+    # Decode, kırpma, ön işleme ve OCR metinleri ScenarioGraph üzerinden senaryolar arasında paylaşılır
+    if replay:
+        graph = ReplayGraph(store.get_all(image_hash), image_path)
+    elif graph is None:
+        graph = (RegionGraph if roi else ScenarioGraph)(image_path, executor, store, image_hash)
+    else:
+        graph.executor = graph.executor or executor
+        graph.store = store
+        graph.image_hash = image_hash
+
+    if lookahead is None:
+        lookahead = len(passes) if agreement is None else (os.cpu_count() or 1)
+    lookahead = max(lookahead, len(PSM_VALUES))  # Belge türü tahmini planın ilk geçişlerini (varsayılan planda ilk senaryonun tüm PSM'lerini) bekler
+
+    # OCR metinleri belge türünden bağımsız olduğu için ilk geçişler tür tahmini beklenmeden gönderilir
+    for crop, pre_process, value in passes[:lookahead]:
+        graph.submit(crop, pre_process, value)
+
+    with graph.trace.span("classify"):  # İlk senaryonun OCR geçişlerini de içerir
+        isReceipt = is_receipt(graph.page_text(False)) if roi else classify_document(graph, passes)
+    if test: print(f"This is a receipt: {isReceipt}")
+
+    # Gerekli alanlar (erken çıkış kararı da bu alanlara göre verilir)
     if isReceipt: must_exist = ["Tarih", "Fiş No", "Toplam", "Belge Türü"]
     if not isReceipt: must_exist = ["Tarih", "Fatura No", "Toplam", "Belge Türü", "KDV Oranı"]
 
-    for field in must_exist:
-        if field not in final_results:
-            final_results[field] = None
+    merger = IncrementalFieldMerger(must_exist, agreement)
+
+    # Dört farklı işlem senaryosunu PSM değerleriyle birlikte sırayla çalıştırıp sonuçları biriktir
+    # (uncropped/unprocessed, uncropped/processed, cropped/unprocessed, cropped/processed)
+    # İlk senaryonun OCR metinleri belge türü tahmininden hazır gelir, alanlar tespit edilen türe göre çıkarılır
+    for i, (crop, pre_process, value) in enumerate(passes):
+        if merger.is_settled():
+            break
+        for ahead in passes[i:i + lookahead]:
+            graph.submit(*ahead)
+        psm_results, component_results = run_receipt_pipeline(image_path, test, crop, pre_process, [value], isReceipt, graph)
+        for result in psm_results:
+            merger.add(result)
+        all_results.extend(psm_results)
+        if isReceipt:
+            all_components.extend(component_results)
+            component_passes.extend([(crop, pre_process, value)] * len(component_results))
+
+    graph.cancel_pending()
+    graph.flush_store()
+
+    # ROI modunda şeritlerde alt kalem satırları yoktur, alt kalemler tam sayfa geçişlerin metinlerinden çıkarılır
+    if roi and isReceipt:
+        all_components = [parse_items(graph.page_text(crop), test) for crop in graph.page_sources()]
+        component_passes = [(crop, False, ROI_ANCHOR_PSM) for crop in graph.page_sources()]
+
+    report = {
+        "passes_used": len(all_results),
+        "passes_total": len(passes),
+        "ocr_calls": graph.ocr_calls,
+        "ocr_pixels": graph.ocr_pixels,
+        "ocr_seconds": round(graph.ocr_seconds, 3),
+        "cache": "miss" if entry_key else "off",
+    }
+    # OCR süresi piksel sayısıyla orantılı kabul edilerek normalizasyonun kazandırdığı (negatifse harcattığı) süre tahmin edilir
+    if NORMALIZE_RESOLUTION and graph.ocr_pixels:
+        report["normalize"] = graph.normalize_info
+        saved = graph.ocr_seconds * (graph.baseline_pixels / graph.ocr_pixels - 1) - graph.normalize_seconds
+        report["est_seconds_saved"] = round(saved, 3)
+    crop_stats = getattr(graph, "crop_stats", None)
+    if crop_stats:
+        report["crop_peak_rss_mb"] = round(crop_stats["peak_rss_mb"], 1) if crop_stats.get("peak_rss_mb") else None
+    if test: print(f"OCR passes used: {report['passes_used']}/{report['passes_total']} ({report['ocr_calls']} Tesseract calls)")
+
+    with graph.trace.span("merge"):
+        final_results = merger.merged()
+
+        # Gerekli alanları kontrol et, yoksa None ata
+        for field in must_exist:
+            if field not in final_results:
+                final_results[field] = None
 
-    if isReceipt and final_results["Toplam"] != None:
-        final_results["Alt Kalemler"] = find_best_components(all_components, final_results["Toplam"], test)
+        if isReceipt and final_results["Toplam"] != None:
+            final_results["Alt Kalemler"] = find_best_components(all_components, final_results["Toplam"], test)
 
-    if isReceipt and final_results["Toplam"] is None:
-        final_results["Alt Kalemler"] = find_most_common_components_by_sum(all_components)
-        if final_results["Alt Kalemler"]:
-            final_results["Toplam"] = round(sum(i["Harcama Tutarı"] for i in final_results["Alt Kalemler"]), 2)
+        if isReceipt and final_results["Toplam"] is None:
+            final_results["Alt Kalemler"] = find_most_common_components_by_sum(all_components)
+            if final_results["Alt Kalemler"]:
+                final_results["Toplam"] = round(sum(i["Harcama Tutarı"] for i in final_results["Alt Kalemler"]), 2)
+
+    report["timings"] = graph.trace.timings()  # Aşama başına milisaniye (bkz. metrics.Trace.timings)
+    if record_wins:
+        report["wins"] = pass_wins(final_results, all_results, passes, all_components, component_passes)
 
     if test:
         print("\nGrouped results by field:\n")
 
         def print_grouped_field(field_name):  #Güzel formatlı outputları gösteren fonksiyon, test açıksa çağrılıyor
             values = []
-            for i, result in enumerate(all_results):
+            for (crop, pre_process, value), result in zip(passes, all_results):
                 if field_name in result:
-                    model_idx = i // 4 + 1
-                    psm_idx = [11, 4, 6, 3][i % 4]
-                    values.append(f"  Model {model_idx} - PSM {psm_idx}: {result[field_name]}")
+                    model_idx = SCENARIOS.index((crop, pre_process)) + 1
+                    values.append(f"  Model {model_idx} - PSM {value}: {result[field_name]}")
             if values:
                 print(f"{field_name} values:")
                 print('\n'.join(values))
@@ -160,15 +880,23 @@ def run(image_path, test=False):
                     print(f"   - {name} | KDV: %{kdv} | Tutar: {amount:.2f}")
         print("\n")
 
+    if entry_key:
+        cache.put(entry_key, final_results)
+
     # Sonuçları results.txt dosyasına JSON olarak kaydet ve döndür
+    if save_results: save_final_results(final_results)
+
+    return final_results, report
+
+# Sonuçları results.txt dosyasına JSON olarak kaydeder
+def save_final_results(final_results):
     results_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.txt")
     with open(results_path, "w", encoding="utf-8") as f:
         json.dump(final_results, f, ensure_ascii=False, indent=4)
 
-    return final_results
-
     
 if __name__ == "__main__":
+    print(">>> Kod başladı <<<")
     image_path = "Karel/receipts/S1.jpg"  #Fotoğraf directory'si
 
     run(image_path, True)
\ No newline at end of file
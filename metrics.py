@@ -0,0 +1,165 @@
+# OCR API için süreç içi metrikler ve istek bazlı izleme (trace).
+#
+# - Counter, Gauge ve Histogram: etiketli (label) değerleri kilit altında tutar, render() ile Prometheus metin
+#   formatında (/metrics) yazılır. Harici bağımlılık gerektirmez.
+# - Trace: bir isteğin aşama sürelerini (span) toplar: decode, classify, crop, normalize, preprocess, her OCR geçişi,
+#   extract ve merge. timings() aşama başına milisaniye özetini döndürür (/ocr?timings=1 yanıtındaki "timings" bloğu).
+
+import contextlib
+import threading
+import time
+
+# Histogram kova sınırları (saniye ve adet)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=(), registry=None):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {', '.join(self.label_names) or '(none)'}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, label_values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.label_names, label_values, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [("_total", key, None, value) for key, value in sorted(self._values.items())]
+
+# Anlık değer; func verilirse değer her render'da func() ile okunur (örn. kuyruk derinliği)
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, description, labels=(), registry=None, func=None):
+        super().__init__(name, description, labels, registry)
+        self.func = func
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.func is not None:
+            return [("", (), None, self.func())]
+        with self._lock:
+            return [("", key, None, value) for key, value in sorted(self._values.items())]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(("_bucket", key, {"le": _format_value(bound)}, cumulative))
+                samples.append(("_sum", key, None, total))
+                samples.append(("_count", key, None, cumulative))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    # Prometheus metin formatı (text/plain; version=0.0.4)
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bir isteğin aşama süreleri. Span'ler iç içe olabilir (örn. classify içindeki OCR geçişleri) ve farklı thread'lerden
+# eklenebilir; executor'da çalışan OCR geçişlerinin süresi add() ile sonradan eklenir.
+class Trace:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, start=None, **attrs):
+        start = time.perf_counter() - seconds if start is None else start
+        with self._lock:
+            self.spans.append({"name": name, "start_ms": round((start - self.start) * 1000, 2), "ms": round(seconds * 1000, 2), **attrs})
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, start, **attrs)
+
+    # Aşama başına toplam milisaniye; OCR geçişleri ayrıca "ocr_passes" listesinde
+    def timings(self):
+        with self._lock:
+            spans = list(self.spans)
+        stages = {}
+        for span in spans:
+            stages[span["name"]] = round(stages.get(span["name"], 0.0) + span["ms"], 2)
+        stages["ocr_passes"] = [{k: v for k, v in span.items() if k not in ("name", "start_ms")} for span in spans if span["name"] == "ocr"]
+        stages["total"] = round((time.perf_counter() - self.start) * 1000, 2)
+        return stages
@@ -1,35 +1,220 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+import io
+import json
 import os
-from main import run  # 'main.py' içindeki run(path) fonksiyonunu içe aktarıyoruz
+import queue
+import time
+from main import run_with_report, create_pass_executor, resolve_passes  # 'main.py' içindeki run(path) fonksiyonunun raporlu versiyonunu içe aktarıyoruz
+from PIL import Image, UnidentifiedImageError
+from processImage import warmup_crop_model, ImageTooLargeError
+from result_cache import create_default_cache
+from ocr_store import OCRTextStore
+from jobs import JobQueue, QueueFullError
+from metrics import REGISTRY, CONTENT_TYPE, Counter, Gauge, Histogram
+
+# Yüklenen dosyaları (büyük olsalar bile) geçici dosyaya değil belleğe alan istek sınıfı
+class InMemoryRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('OCR_MAX_UPLOAD_MB', '20')) * 1024 * 1024  # Bellekte tutulacak en büyük yükleme
 CORS(app)
 
-UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Autocrop modelini sunucu açılırken bir kez yükle, istekler hazır modeli kullansın (kırpma senaryosu yoksa gerekmez).
+# Model veya backend eksikse API yine açılır, hata ilk kırpma isteğinde o isteğe döner
+if any(crop for crop, _, _ in resolve_passes()):
+    try:
+        warmup_crop_model()
+    except Exception as e:
+        app.logger.error(f"Autocrop model warmup failed: {type(e).__name__}: {e}")
+
+# Erken çıkış eşiği: zorunlu alanlarda lider değer bu kadar oy öndeyse kalan OCR geçişleri atlanır
+# (0 = kapalı, varsayılan; run(), batch.py ve test.py gibi tüm geçişler birleştirilir)
+AGREEMENT = int(os.environ.get('OCR_AGREEMENT', '0')) or None
+if AGREEMENT is not None and AGREEMENT < 1:
+    raise ValueError(f"OCR_AGREEMENT must be 0 (off) or at least 1, got {AGREEMENT}")
 
-@app.route('/ocr', methods=['POST'])
-def ocr():
+# OCR_ROI=1: tam sayfa geçişler yerine sadece alan anahtarı içeren satırlar OCR'lanır (bkz. main.RegionGraph)
+ROI = os.environ.get('OCR_ROI') == '1'
+
+# Bir fişin OCR geçişlerini paralel çalıştıran ortak executor (0 = geçişler sırayla çalışır)
+PASS_WORKERS = int(os.environ.get('OCR_PASS_WORKERS', os.cpu_count() or 1))
+pass_executor = create_pass_executor(workers=PASS_WORKERS) if PASS_WORKERS > 0 else None
+
+# Aynı görüntü tekrar yüklenirse sonucu OCR yapmadan döndüren önbellek (bkz. result_cache.create_default_cache)
+result_cache = create_default_cache()
+
+# Ham OCR metinlerinin kaydedildiği depo, postProcess değişikliklerini replay ile ölçmek için. Varsayılan kapalıdır:
+# yüklenen her görüntünün metni süresiz saklanır, sadece replay için veri toplanırken açılmalı (örn. cache/ocr_texts.sqlite)
+OCR_STORE_PATH = os.environ.get('OCR_STORE_PATH', '')
+ocr_store = OCRTextStore(OCR_STORE_PATH) if OCR_STORE_PATH else None
+
+# Aynı anda işlenecek en fazla görüntü sayısı ve bunların dışında kuyrukta bekleyebilecek en fazla iş sayısı
+JOB_CONCURRENCY = int(os.environ.get('OCR_JOB_CONCURRENCY', '2'))
+JOB_QUEUE_DEPTH = int(os.environ.get('OCR_JOB_QUEUE_DEPTH', '16'))
+JOB_TTL = int(os.environ.get('OCR_JOB_TTL', '3600'))  # Biten işlerin sonuçları bu kadar saniye sorgulanabilir
+
+# /metrics ile Prometheus formatında yayınlanan metrikler
+REQUESTS = Counter('ocr_requests', 'Processed OCR images by outcome', labels=('status',))
+ERRORS = Counter('ocr_errors', 'Failed OCR images by exception type', labels=('type',))
+CACHE_RESULTS = Counter('ocr_cache', 'Result cache lookups (hit, miss, off)', labels=('result',))
+REJECTED = Counter('ocr_queue_rejected', 'Uploads rejected with 429 because the job queue was full')
+REQUEST_SECONDS = Histogram('ocr_request_seconds', 'Processing time per image, without queue wait')
+STAGE_SECONDS = Histogram('ocr_stage_seconds', 'Time per pipeline stage and image (OCR passes summed, may overlap)', labels=('stage',))
+PASSES = Histogram('ocr_passes_per_request', 'OCR passes used per image', buckets=(0, 1, 2, 4, 6, 8, 10, 12, 14, 16))
+
+# Decode edilemeyen veya piksel sınırını aşan yüklemeler; istemciye iç hata metni (örn. BytesIO nesnesi) yerine bu mesaj döner
+DECODE_ERRORS = (UnidentifiedImageError, Image.DecompressionBombError, ImageTooLargeError)
+INVALID_IMAGE_MESSAGE = 'Geçersiz görüntü dosyası.'
+
+class InvalidImageError(ValueError):
+    pass
+
+# Bellekteki görüntü byte'larını iş akışından geçirir (görüntü diske yazılmadan bir kez decode edilir)
+def process_upload(image_bytes, filename):
+    start = time.perf_counter()
+    try:
+        result, report = run_with_report(image_bytes, test=False, agreement=AGREEMENT, executor=pass_executor, cache=result_cache, store=ocr_store, save_results=False, roi=ROI)  # test=True olursa debug dosyaları da yaratır
+    except Exception as e:
+        REQUESTS.inc(status='error')
+        ERRORS.inc(type=type(e).__name__)
+        if isinstance(e, DECODE_ERRORS):
+            app.logger.warning(f"{filename}: {type(e).__name__}: {e}")
+            raise InvalidImageError(INVALID_IMAGE_MESSAGE) from e
+        raise
+    app.logger.info(f"{filename}: {report['passes_used']}/{report['passes_total']} OCR passes used")
+    record_metrics(report, time.perf_counter() - start)
+    return result, report
+
+def record_metrics(report, seconds):
+    REQUESTS.inc(status='ok')
+    CACHE_RESULTS.inc(result=report['cache'])
+    REQUEST_SECONDS.observe(seconds)
+    PASSES.observe(report['passes_used'])
+    for stage, ms in report.get('timings', {}).items():
+        if stage not in ('total', 'ocr_passes'):
+            STAGE_SECONDS.observe(ms / 1000, stage=stage)
+
+job_queue = JobQueue(process_upload, concurrency=JOB_CONCURRENCY, max_queue=JOB_QUEUE_DEPTH, ttl=JOB_TTL)
+
+QUEUE_DEPTH = Gauge('ocr_queue_depth', 'Jobs waiting for a worker', func=lambda: job_queue.depth)
+
+# İstekteki görüntüyü doğrular ve byte'larını okur, hata varsa (yanıt, durum kodu) döndürür
+def read_upload():
     if 'image' not in request.files:
-        return jsonify({'error': 'Gönderilen istek "image" dosyası içermiyor.'}), 400
+        return None, (jsonify({'error': 'Gönderilen istek "image" dosyası içermiyor.'}), 400)
 
     image_file = request.files['image']
     if image_file.filename == '':
-        return jsonify({'error': 'Dosya adı boş.'}), 400
+        return None, (jsonify({'error': 'Dosya adı boş.'}), 400)
 
-    # Dosyayı kaydet
-    temp_path = os.path.join(UPLOAD_FOLDER, image_file.filename)
-    image_file.save(temp_path)
+    return (image_file.read(), image_file.filename), None
 
+# Yüklemeyi kuyruğa ekler, kuyruk doluysa 429 döndürür
+def enqueue_upload(image_bytes, filename):
     try:
-        result = run(temp_path, test=False)  # test=True olursa debug dosyaları da yaratır
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        return job_queue.submit(image_bytes, filename), None
+    except QueueFullError as e:
+        REJECTED.inc()
+        return None, (jsonify({'error': str(e)}), 429)
+
+# İstemci ?timings=1 veya X-OCR-Timings: 1 ile aşama sürelerini (ms) yanıtta isteyebilir
+def timings_requested():
+    return request.args.get('timings') == '1' or request.headers.get('X-OCR-Timings') == '1'
+
+def job_response(job, timings=False):
+    body = job.result
+    if timings:
+        body = {**job.result, 'timings': job.report.get('timings', {})}
+    response = jsonify(body)
+    response.headers['X-OCR-Passes-Used'] = str(job.report['passes_used'])
+    response.headers['X-OCR-Cache'] = job.report['cache']
+    if job.report.get('crop_peak_rss_mb') is not None:
+        response.headers['X-OCR-Crop-Peak-RSS-MB'] = str(job.report['crop_peak_rss_mb'])
+    return response
+
+# Asenkron API: görüntüyü kuyruğa ekler ve hemen iş kimliğini döndürür (202)
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    upload, error = read_upload()
+    if error: return error
+
+    job, error = enqueue_upload(*upload)
+    if error: return error
+
+    response = jsonify(job.to_dict())
+    response.headers['Location'] = f"/jobs/{job.id}"
+    return response, 202
+
+# İşin durumunu (queued, running, done, failed) ve bittiyse sonucunu döndürür
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'İş bulunamadı.'}), 404
+    return jsonify(job.to_dict())
+
+# Senkron API: işi kuyruğa ekler ve bitmesini bekleyip sonucu döndürür
+@app.route('/ocr', methods=['POST'])
+def ocr():
+    upload, error = read_upload()
+    if error: return error
+
+    job, error = enqueue_upload(*upload)
+    if error: return error
+
+    job.done.wait()
+    if job.status == "failed":
+        return jsonify({'error': job.error}), 400 if job.error_type and issubclass(job.error_type, InvalidImageError) else 500
+    return job_response(job, timings_requested())
+
+# Toplu API: birden fazla "image" parçasını alır, sunucunun worker havuzunda eşzamanlı işler ve her görüntü bittikçe
+# bir NDJSON satırı gönderir (yavaş bir görüntü diğerlerinin sonuçlarını bekletmez). Satırlar bitiş sırasıyla gelir,
+# hangi görüntüye ait olduğu "index" (istekteki sıra) ve "filename" alanlarından anlaşılır.
+@app.route('/ocr/batch', methods=['POST'])
+def ocr_batch():
+    image_files = [f for f in request.files.getlist('image') if f.filename != '']
+    if not image_files:
+        return jsonify({'error': 'Gönderilen istek "image" dosyası içermiyor.'}), 400
+
+    uploads = [(image_file.read(), image_file.filename) for image_file in image_files]  # Stream başlamadan önce oku
+
+    def generate():
+        pending = list(enumerate(uploads))
+        finished = queue.Queue()
+        in_flight = 0
+
+        while pending or in_flight:
+            # Kuyrukta yer oldukça görüntüleri gönder, dolarsa bu isteğin işlerinden biri bitince tekrar dene
+            while pending:
+                index, (image_bytes, filename) = pending[0]
+                try:
+                    job_queue.submit(image_bytes, filename, on_finish=lambda job, index=index, filename=filename: finished.put((index, filename, job)))
+                except QueueFullError:
+                    break
+                pending.pop(0)
+                in_flight += 1
+
+            try:
+                index, filename, job = finished.get(timeout=None if in_flight else 0.1)
+            except queue.Empty:
+                continue
+            in_flight -= 1
+
+            line = {'index': index, 'filename': filename, **job.to_dict()}
+            if job.report:
+                line['passes_used'] = job.report['passes_used']
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Prometheus formatında süreç metrikleri (istek sayıları, önbellek, gecikme ve aşama histogramları, kuyruk derinliği)
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1', threaded=True)
@@ -0,0 +1,68 @@
+# Ham OCR metinlerini kalıcı olarak saklayan SQLite deposu.
+#
+# Her metin (görüntü hash'i, crop, pre_process, psm) anahtarıyla saklanır. Böylece postProcess içindeki regexler
+# veya birleştirme mantığı değiştiğinde tüm korpus için Tesseract tekrar çalıştırılmadan, kayıtlı metinler üzerinden
+# alan çıkarımı, oylama ve alt kalem seçimi yeniden yapılabilir (bkz. main.run(..., replay=True)).
+
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_STORE_PATH = os.path.join("cache", "ocr_texts.sqlite")
+
+class OCRTextStore:
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)  # Batch worker'ları aynı dosyaya yazabilir
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_texts ("
+            "image_hash TEXT NOT NULL, crop INTEGER NOT NULL, pre_process INTEGER NOT NULL, psm INTEGER NOT NULL, "
+            "text TEXT NOT NULL, backend TEXT, created_at REAL NOT NULL, "
+            "PRIMARY KEY (image_hash, crop, pre_process, psm))"
+        )
+        self._conn.commit()
+
+    def put(self, image_hash, crop, pre_process, psm, text, backend=None):
+        self.put_many(image_hash, {(crop, pre_process, psm): text}, backend)
+
+    # Bir görüntünün metinlerini ({(crop, pre_process, psm): text}) tek transaction'da kaydeder
+    def put_many(self, image_hash, texts, backend=None):
+        if not texts:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ocr_texts (image_hash, crop, pre_process, psm, text, backend, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(image_hash, int(crop), int(pre_process), psm, text, backend, now) for (crop, pre_process, psm), text in texts.items()],
+            )
+            self._conn.commit()
+
+    def get(self, image_hash, crop, pre_process, psm):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM ocr_texts WHERE image_hash = ? AND crop = ? AND pre_process = ? AND psm = ?",
+                (image_hash, int(crop), int(pre_process), psm),
+            ).fetchone()
+        return row[0] if row else None
+
+    # Bir görüntünün kayıtlı tüm metinlerini {(crop, pre_process, psm): text} olarak döndürür
+    def get_all(self, image_hash):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT crop, pre_process, psm, text FROM ocr_texts WHERE image_hash = ?", (image_hash,)
+            ).fetchall()
+        return {(bool(crop), bool(pre_process), psm): text for crop, pre_process, psm, text in rows}
+
+    def image_hashes(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT image_hash FROM ocr_texts")]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,187 @@
+# OCR geçiş planları (pass schedule): run()'ın hangi (crop, pre_process, psm) geçişlerini hangi sırayla çalıştıracağı.
+#
+# Varsayılan plan 4 senaryo x 4 PSM = 16 geçiştir. Etiketli korpus üzerinde hiç kazanan değer üretmeyen geçişler
+# çıkarılarak daha kısa bir plan türetilebilir ve profiles/<isim>.json olarak kaydedilip isimle yüklenebilir:
+#   run(path, profile="fast"), OCR_PASS_PROFILE=fast python ocr_api.py, python test.py --profile fast
+#
+# Komutlar (test.py'deki beklenen çıktılar etiket olarak kullanılır):
+#   profile: tüm geçişlerle çalışır, her doğru alan değerini ve seçilen alt kalem listesini hangi geçişlerin ürettiğini sayar.
+#   derive:  OCR deposundaki kayıtlı metinler üzerinden (replay) açgözlü seçimle sıralı, kısaltılmış bir plan türetir:
+#            her adımda korpus doğruluğunu en çok artıran geçiş eklenir, tam plan doğruluğuna veya --max-passes'a ulaşınca durur.
+#
+# Örnek:
+#   python test.py                                   # Ham OCR metinlerini depoya kaydeder
+#   python pass_schedule.py profile --replay -o cache/pass_wins.json
+#   python pass_schedule.py derive --name fast --max-passes 8
+#   python test.py --profile fast --baseline cache/test_baseline.json
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+PROFILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+
+_profiles = {}
+
+# Profil ismini dosya yoluna çevirir (".json" ile bitiyorsa doğrudan yol kabul edilir)
+def profile_path(name):
+    return name if name.endswith(".json") else os.path.join(PROFILES_DIR, f"{name}.json")
+
+# Profildeki geçişleri [(crop, pre_process, psm), ...] olarak döndürür, dosya süreç başına bir kez okunur
+def load_profile(name):
+    if name not in _profiles:
+        path = profile_path(name)
+        if not os.path.exists(path):
+            available = sorted(os.path.splitext(f)[0] for f in os.listdir(PROFILES_DIR) if f.endswith(".json")) if os.path.isdir(PROFILES_DIR) else []
+            raise ValueError(f"Unknown pass profile: {name}. Available profiles are {', '.join(available) or '(none)'}")
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        passes = [(bool(crop), bool(pre_process), int(psm)) for crop, pre_process, psm in data["passes"]]
+        if not passes:
+            raise ValueError(f"Pass profile {name} has no passes")
+        _profiles[name] = passes
+    return _profiles[name]
+
+def save_profile(name, passes, **info):
+    path = profile_path(name)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    data = {"name": os.path.splitext(os.path.basename(path))[0], "passes": [list(p) for p in passes], **info}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    _profiles.pop(name, None)
+    return path
+
+# Birleştirilmiş sonuçtaki her alan değerini ve seçilen alt kalem listesini üreten geçişler
+# results/passes aynı sırada, components/component_passes aynı sırada olmalı
+def pass_wins(final_results, results, passes, components=(), component_passes=()):
+    wins = {}
+    for field, value in final_results.items():
+        if field == "Alt Kalemler" or value is None:
+            continue
+        wins[field] = [list(p) for p, result in zip(passes, results) if result.get(field) == value]
+    chosen = final_results.get("Alt Kalemler")
+    if chosen:
+        wins["Alt Kalemler"] = [list(p) for p, items in zip(component_passes, components) if items == chosen]
+    return wins
+
+def load_corpus(samples_dir):
+    from test import expected_outputs, SAMPLES_DIR
+    samples_dir = samples_dir or SAMPLES_DIR
+    corpus = []
+    for filename, expected in expected_outputs.items():
+        filepath = os.path.join(samples_dir, filename)
+        if os.path.exists(filepath):
+            corpus.append((filepath, expected))
+        else:
+            print(f"Missing file: {filepath}", file=sys.stderr)
+    return corpus
+
+# Planı korpus üzerinde çalıştırır: (doğru alan sayısı, {geçiş: doğru kazanç sayısı}, alt kalem kazanç sayıları)
+def evaluate(corpus, passes, store, replay):
+    from main import run_with_report
+    from test import FIELDS, field_matches
+
+    correct = 0
+    field_wins, component_wins = Counter(), Counter()
+    for filepath, expected in corpus:
+        result, report = run_with_report(filepath, save_results=False, store=store, replay=replay, profile=passes, record_wins=True)
+        for field in FIELDS:
+            if field_matches(result.get(field), expected.get(field)):
+                correct += 1
+                field_wins.update(tuple(p) for p in report["wins"].get(field, []))
+        component_wins.update(tuple(p) for p in report["wins"].get("Alt Kalemler", []))
+    return correct, field_wins, component_wins
+
+def format_pass(p):
+    crop, pre_process, psm = p
+    return f"crop={int(crop)} pre={int(pre_process)} psm={psm}"
+
+def command_profile(args, corpus, store):
+    from main import default_passes
+    passes = default_passes()
+    correct, field_wins, component_wins = evaluate(corpus, passes, store, args.replay)
+
+    from test import FIELDS
+    total = len(corpus) * len(FIELDS)
+    print(f"{len(corpus)} receipts, {correct}/{total} fields correct with all {len(passes)} passes\n")
+    print(f"{'pass':<26}{'correct field wins':>20}{'item list wins':>16}")
+    for p in sorted(passes, key=lambda p: (-field_wins[p], -component_wins[p])):
+        print(f"{format_pass(p):<26}{field_wins[p]:>20}{component_wins[p]:>16}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"receipts": len(corpus), "correct": correct, "total": total,
+                       "passes": [{"pass": list(p), "field_wins": field_wins[p], "component_wins": component_wins[p]} for p in passes]},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\nWins written to {args.output}")
+    return 0
+
+def command_derive(args, corpus, store):
+    from main import default_passes
+    from test import FIELDS
+    candidates = default_passes()
+    total = len(corpus) * len(FIELDS)
+
+    full_correct, field_wins, component_wins = evaluate(corpus, candidates, store, True)
+    max_passes = args.max_passes or len(candidates) // 2
+    print(f"Full schedule: {full_correct}/{total} fields correct with {len(candidates)} passes, selecting up to {max_passes}\n")
+
+    selected, correct = [], 0
+    while candidates and len(selected) < max_passes and correct < full_correct:
+        # Eşitlikte daha çok kazanan değer üreten, sonra varsayılan sırada önce gelen geçiş seçilir
+        scored = [(evaluate(corpus, selected + [p], store, True)[0], field_wins[p] + component_wins[p], -i, p) for i, p in enumerate(candidates)]
+        correct, _, _, best = max(scored)
+        selected.append(best)
+        candidates.remove(best)
+        print(f"{len(selected):>2}. {format_pass(best):<26}{correct}/{total} fields correct")
+
+    print()
+    if not selected:
+        print("No pass produced a correct field, nothing to write")
+        return 1
+    if correct < full_correct:
+        print(f"Warning: {len(selected)} passes reach {correct}/{total} fields, the full schedule reaches {full_correct}/{total}")
+
+    path = save_profile(args.name, selected, fields=FIELDS, receipts=len(corpus), correct=correct, full_correct=full_correct,
+                        total=total, created_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    print(f"Profile '{args.name}' with {len(selected)} passes written to {path}")
+    return 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Profile which OCR passes produce winning values and derive a reduced pass schedule.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    profile = subparsers.add_parser("profile", help="Count winning field values and item lists per pass with the full schedule")
+    profile.add_argument("--replay", action="store_true", help="Use stored OCR texts instead of running OCR")
+    profile.add_argument("-o", "--output", help="Write the win counts to this JSON file")
+
+    derive = subparsers.add_parser("derive", help="Greedily derive an ordered, reduced schedule from stored OCR texts")
+    derive.add_argument("--name", required=True, help="Profile name (profiles/<name>.json) or .json path")
+    derive.add_argument("--max-passes", type=int, default=None, help="Upper bound on passes (default: half of the full schedule)")
+
+    for subparser in (profile, derive):
+        subparser.add_argument("--samples", default=None, help="Directory with the labeled receipts (default: test.SAMPLES_DIR)")
+        subparser.add_argument("--store", default=None, help="OCR text store (default: ocr_store.DEFAULT_STORE_PATH)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    from ocr_store import OCRTextStore, DEFAULT_STORE_PATH
+
+    corpus = load_corpus(args.samples)
+    if not corpus:
+        print("No labeled receipts found")
+        return 1
+    store = OCRTextStore(args.store or DEFAULT_STORE_PATH)
+
+    if args.command == "profile":
+        return command_profile(args, corpus, store)
+    return command_derive(args, corpus, store)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
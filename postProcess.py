@@ -14,22 +14,27 @@
 import regex as re
 from collections import defaultdict, Counter
 
+# Alan çıkarımı, alt kalem ayrıştırma veya oylama mantığı değiştiğinde artırılmalı (önbellekteki eski sonuçlar geçersiz olur)
+POSTPROCESS_VERSION = "1"
+
 # OCR'da sıkça karışan karakterleri düzeltir (örn: O → 0, I → 1)
 # Tarih formatları için / ve - işaretlerini . ile değiştirir
+# Çeviri tablosu import sırasında bir kez oluşturulur, str.translate ile tek geçişte uygulanır
+OCR_FIX_TABLE = str.maketrans({
+    'O': '0',
+    'o': '0',
+    'I': '1',
+    'i': '1',
+    'İ': '1',
+    'l': '1',
+    'S': '5',
+    'B': '8',
+    '/': '.',    # 12/12/2025 → 12.12.2025
+    '-': '.'     # 12-12-2025 → 12.12.2025
+})
+
 def fix_common_ocr_errors(text: str) -> str:
-    replacements = {
-        'O': '0',
-        'o': '0',
-        'I': '1',
-        'i': '1',
-        'İ': '1',
-        'l': '1',
-        'S': '5',
-        'B': '8',
-        '/': '.',    # 12/12/2025 → 12.12.2025
-        '-': '.'     # 12-12-2025 → 12.12.2025
-    }
-    return ''.join(replacements.get(char, char) for char in text)
+    return text.translate(OCR_FIX_TABLE)
 
 
 # OCR sonrası rakamları (1.342,25) düzeltip, Türkçe/İngilizce ondalık ayracını doğru biçime çevirir ve float şeklinde döndürür
@@ -136,99 +141,136 @@ def merge_field_results(results):
     return final_fields
 
 
+# merge_field_results'ın artımlı versiyonu: OCR sonuçlarını geldikçe toplar ve oyları anlık tutar.
+# Zorunlu alanların (required_fields) hepsinde lider değer ikinciden en az `agreement` oy öndeyse sonuç kararlı sayılır,
+# böylece çağıran taraf kalan PSM/senaryo geçişlerini çalıştırmadan durabilir. agreement None ise hiçbir zaman durmaz.
+# Nihai değerler yine merge_field_results ile (aynı override kurallarıyla) hesaplanır.
+class IncrementalFieldMerger:
+    def __init__(self, required_fields, agreement = None):
+        self.required_fields = list(required_fields)
+        self.agreement = agreement
+        self.results = []
+        self.votes = defaultdict(Counter)
+
+    def add(self, fields):
+        self.results.append(fields)
+        for key, val in fields.items():
+            if val:
+                self.votes[key][val] += 1
+
+    def has_stable_winner(self, key):
+        ranked = self.votes[key].most_common(2)
+        if not ranked:
+            return False
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0
+        return ranked[0][1] - runner_up >= self.agreement
+
+    def is_settled(self):
+        if self.agreement is None:
+            return False
+        return all(self.has_stable_winner(key) for key in self.required_fields)
+
+    def merged(self):
+        return merge_field_results(self.results)
+
+
+# Alan çıkarımında kullanılan regexler import sırasında bir kez derlenir
+
+# Ortak alanlar (Fiş veya Fatura fark etmeksizin aranan alanlar)
+COMMON_FIELD_PATTERNS = {
+    "Tarih": re.compile(r"\b(\d{2}[./-]\d{2}[./-]\d{4})\b", re.IGNORECASE),
+    "Toplam": re.compile(
+        r"(?<!ara\s)(?<!4ra\s)(?<!afa\s)"
+        r"(?<!kdv(?:[’'`´]li?)?\s)(?<!kdu\s)(?<!kdy\s)(?<!kdi\s)(?<!kdw\s)(?<!kdn\s)(?<!kdx\s)"
+        r"\btoplam(?:\s+tutar(?!ı))?\b[^\d]{0,3}[*x»:/-]?\s*([\dOolIıİi.,\s]{1,20}\d)",
+        re.IGNORECASE
+    ),
+    # Aşağıdaki alanlar yorumda ama hazır (ileride aktif edilebilir)
+    # "Toplam KDV": re.compile(
+    #     r"(?:toplam\s+kdv|topkdv|topkdu|TOPVP|topkov|topkdy|topkdi|ToOPKDV|TOPKÜV|topkdw|topkdı|topkvu|topkd|topkdvı)"
+    #     r"[^\dO]{0,3}[*x»]?\s*([\dOolIıİi.,\s]{1,15}\d)",
+    #     re.IGNORECASE
+    # ),
+    # "Ticaret Sicil No": re.compile(
+    #     r"(?:ticaret\s*sicil\s*no|t\.?\s*s\.?\s*no|tic\s*sic\s*no|tsn|sicil\s*no)"
+    #     r"[^\d]{0,3}[*x»:]?\s*([\dOolIıİi]{6})\b",
+    #     re.IGNORECASE
+    # ),
+    # "Mersis No": re.compile(
+    #     r"(?:mersis\s*no|mersis\s*number|mersis\s*nu|mers\s*no)"
+    #     r"[^\d]{0,3}[*x»:]?\s*(\d{16})\b",
+    #     re.IGNORECASE
+    # ),
+    # "ETTN": re.compile(
+    #     r"(?:[eEfF][\s.:,;_-]*[tT1İil][\s.:,;_-]*[tT1İil][\s.:,;_-]*[nNhHmM])"
+    #     r"[\s.:,;_-]*[:\-]?\s*"
+    #     r"([a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12})",
+    #     re.IGNORECASE
+    # ),
+    # "Vergi Kimlik No": re.compile(
+    #     r"(?:vergi\s*kimlik\s*no|vkn)[^\dOolIıİ]{0,3}[*x»:]?\s*([0-9OolIıİ]{10})\b",
+    #     re.IGNORECASE
+    # ),
+}
+
+# Sadece fişlerde aranan alanlar
+RECEIPT_FIELD_PATTERNS = {
+    "Fiş No": re.compile(
+        r"(?:f[ıiİl1|][şs5]\s*no|fiş\s*no|fişno)"
+        r"[^\d\n]{0,5}[\s\n]*([\d]{1,4})\b",
+        re.IGNORECASE
+    ),
+}
+
+# Sadece faturalar için aranan alanlar
+FATURA_NO_PATTERN = re.compile(
+    r"(?:fatura\s*(?:no|nu|n[o0])|fat\s*no)[^\w\d]{0,4}[:\-]?\s*([A-ZİŞĞÜÇÖ]{1,4}[\s\-]?\d{10,16})",
+    re.IGNORECASE
+)
+# Fallback: Eğer yukarıdaki regex yakalamazsa alternatif olarak bu desen ile arar
+FATURA_NO_FALLBACK_PATTERN = re.compile(r"\b[İIı]?\s*([A-ZİŞĞÜÇÖ]{3}\d{13})\b")
+# KDV oranı faturalarda bazen farklı satırlarda bulunabilir, ona göre geniş arama yapar
+KDV_ORANI_PATTERN = re.compile(
+    r"kdv\s*oran[ıiİl1][^\d\n]{0,40}(?:\n[^\d\n]{0,40}){0,3}[^0-9]{0,10}(\d{1,2})\b",
+    re.IGNORECASE
+)
+
+NON_DIGIT_PATTERN = re.compile(r"\D")
+
+# ROI modunda (bkz. main.RegionGraph) tam sayfa OCR satırları arasında alan değerlerini içerebilecek satırları bulan desenler.
+# Alan regexlerinden daha gevşektir, çünkü tek geçişlik tam sayfa OCR'da değerin kendisi okunamamış olabilir.
+# Değer: (desen, anahtar satırdan sonra bölgeye eklenecek satır sayısı)
+ROI_ANCHOR_PATTERNS = {
+    "Tarih": (re.compile(r"\d{2}\s?[./-]\s?\d{2}\s?[./-]\s?\d{2,4}|tar[iİı1l]h", re.IGNORECASE), 0),
+    "Toplam": (re.compile(r"t[o0]p[l1|]am", re.IGNORECASE), 0),
+    "Fiş No": (re.compile(r"f[ıiİl1|][şs5]\s*n[o0]", re.IGNORECASE), 1),  # Numara alt satırda olabilir
+    "Fatura No": (re.compile(r"fatura\s*n|fat\s*n[o0]|[A-ZİŞĞÜÇÖ]{3}\d{13}", re.IGNORECASE), 0),
+    "KDV Oranı": (re.compile(r"kdv\s*oran", re.IGNORECASE), 3),  # KDV_ORANI_PATTERN gibi oran 3 satır aşağıda olabilir
+}
+
+# Satırın hangi alanların anahtarı olduğunu döndürür
+def roi_anchor_fields(line):
+    return [field for field, (pattern, _) in ROI_ANCHOR_PATTERNS.items() if pattern.search(line)]
+
 # OCR'dan alınan metinde belge türüne göre (Fiş/Fatura) ilgili alanları regex ile tespit eder,
 # bulunan değerleri OCR hatalarını düzelterek normalize eder ve sonuçları döndürür.
+# Sadece tespit edilen belge türü için gereken regexler çalıştırılır.
 def extract_fields(text, isReceipt = True):
     fields = {}
 
-    # Ortak alanlar (Fiş veya Fatura fark etmeksizin aranan alanlar)
-    common_fields = {
-        "Tarih": re.search(r"\b(\d{2}[./-]\d{2}[./-]\d{4})\b", text, re.IGNORECASE),
-        "Toplam": re.search(
-            r"(?<!ara\s)(?<!4ra\s)(?<!afa\s)"
-            r"(?<!kdv(?:[’'`´]li?)?\s)(?<!kdu\s)(?<!kdy\s)(?<!kdi\s)(?<!kdw\s)(?<!kdn\s)(?<!kdx\s)"
-            r"\btoplam(?:\s+tutar(?!ı))?\b[^\d]{0,3}[*x»:/-]?\s*([\dOolIıİi.,\s]{1,20}\d)",
-            text,
-            re.IGNORECASE
-        ),
-        # Aşağıdaki alanlar yorumda ama hazır (ileride aktif edilebilir)
-        # "Toplam KDV": re.search(
-        #     r"(?:toplam\s+kdv|topkdv|topkdu|TOPVP|topkov|topkdy|topkdi|ToOPKDV|TOPKÜV|topkdw|topkdı|topkvu|topkd|topkdvı)"
-        #     r"[^\dO]{0,3}[*x»]?\s*([\dOolIıİi.,\s]{1,15}\d)",
-        #     text,
-        #     re.IGNORECASE
-        # ),
-        # "Ticaret Sicil No": re.search(
-        #     r"(?:ticaret\s*sicil\s*no|t\.?\s*s\.?\s*no|tic\s*sic\s*no|tsn|sicil\s*no)"
-        #     r"[^\d]{0,3}[*x»:]?\s*([\dOolIıİi]{6})\b",
-        #     text,
-        #     re.IGNORECASE
-        # ),
-        # "Mersis No": re.search(
-        #     r"(?:mersis\s*no|mersis\s*number|mersis\s*nu|mers\s*no)"
-        #     r"[^\d]{0,3}[*x»:]?\s*(\d{16})\b",
-        #     text,
-        #     re.IGNORECASE
-        # ),
-        # "ETTN": re.search(
-        #     r"(?:[eEfF][\s.:,;_-]*[tT1İil][\s.:,;_-]*[tT1İil][\s.:,;_-]*[nNhHmM])"
-        #     r"[\s.:,;_-]*[:\-]?\s*"
-        #     r"([a-fA-F0-9]{8}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{4}-[a-fA-F0-9]{12})",
-        #     text,
-        #     re.IGNORECASE
-        # ),
-        # "Vergi Kimlik No": re.search(
-        #     r"(?:vergi\s*kimlik\s*no|vkn)[^\dOolIıİ]{0,3}[*x»:]?\s*([0-9OolIıİ]{10})\b",
-        #     text,
-        #     re.IGNORECASE
-        # ), 
-    }
-
-    # Sadece fişlerde aranan alanlar
-    receipt_fields = {
-        "Fiş No": re.search(
-            r"(?:f[ıiİl1|][şs5]\s*no|fiş\s*no|fişno)"
-            r"[^\d\n]{0,5}[\s\n]*([\d]{1,4})\b",
-            text,
-            re.IGNORECASE
-        ),
-    }
-
-    # Sadece faturalar için aranan alanlar
-    bill_fields = {}
-    bill_fatura_no = re.search(
-        r"(?:fatura\s*(?:no|nu|n[o0])|fat\s*no)[^\w\d]{0,4}[:\-]?\s*([A-ZİŞĞÜÇÖ]{1,4}[\s\-]?\d{10,16})",
-        text,
-        re.IGNORECASE
-    )
-    if not bill_fatura_no:
-        # Fallback: Eğer yukarıdaki regex yakalamazsa alternatif olarak bu desen ile arar
-        bill_fatura_no = re.search(
-            r"\b[İIı]?\s*([A-ZİŞĞÜÇÖ]{3}\d{13})\b",
-            text
-        )
-    if bill_fatura_no:
-        bill_fields["Fatura No"] = bill_fatura_no
-
-    # KDV oranı faturalarda bazen farklı satırlarda bulunabilir, ona göre geniş arama yapar
-    bill_fields["KDV Oranı"] = re.search(
-        r"kdv\s*oran[ıiİl1][^\d\n]{0,40}(?:\n[^\d\n]{0,40}){0,3}[^0-9]{0,10}(\d{1,2})\b",
-        text,
-        re.IGNORECASE
-    )
-
-    # İlk olarak ortak alanları ekliyoruz
-    from_regex = {**common_fields}
+    # İlk olarak ortak alanları arıyoruz
+    from_regex = [(key, pattern.search(text)) for key, pattern in COMMON_FIELD_PATTERNS.items()]
 
     if isReceipt:
-        from_regex.update(receipt_fields)
+        from_regex += [(key, pattern.search(text)) for key, pattern in RECEIPT_FIELD_PATTERNS.items()]
         fields["Belge Türü"] = "Fiş"
     else:
-        from_regex.update(bill_fields)
+        bill_fatura_no = FATURA_NO_PATTERN.search(text) or FATURA_NO_FALLBACK_PATTERN.search(text)
+        from_regex += [("Fatura No", bill_fatura_no), ("KDV Oranı", KDV_ORANI_PATTERN.search(text))]
         fields["Belge Türü"] = "Fatura"
 
     # Regex ile yakalanan değerleri işleyip OCR hatalarını temizleyerek alanlara ekler
-    for key, match in from_regex.items():
+    for key, match in from_regex:
         if match:
             raw_val = match.group(1)
             if key in ["Toplam", "Toplam KDV"]:
@@ -248,7 +290,7 @@ def extract_fields(text, isReceipt = True):
                 if key == "Tarih":
                     fixed_val = fix_date_ocr_errors(fixed_val)
                 elif key == "Vergi Kimlik No":
-                    cleaned_vkn = re.sub(r"\D", "", fixed_val)
+                    cleaned_vkn = NON_DIGIT_PATTERN.sub("", fixed_val)
                     if cleaned_vkn == "5240008809":  # Karel’in kendi VKN’sini filtrele
                         continue
                     fixed_val = cleaned_vkn
@@ -256,6 +298,29 @@ def extract_fields(text, isReceipt = True):
 
     return fields
 
+# Birden fazla OCR metni için alanları ve alt kalemleri tek çağrıda çıkarır.
+# item_mask verilirse sadece True olan metinlerden alt kalem çıkarılır (örn. PSM 11 alt kalemler için kötü), diğerleri None döner.
+# Faturalarda alt kalem çıkarılmaz. Aynı metin birden fazla kez gelirse (aynı girdili senaryolar) bir kez işlenir.
+def extract_batch(texts, isReceipt = True, item_mask = None, test = False):
+    fields_list = []
+    items_list = []
+    fields_by_text = {}
+    items_by_text = {}
+
+    for i, text in enumerate(texts):
+        if text not in fields_by_text:
+            fields_by_text[text] = extract_fields(text, isReceipt)
+        fields_list.append(dict(fields_by_text[text]))
+
+        if isReceipt and (item_mask is None or item_mask[i]):
+            if text not in items_by_text:
+                items_by_text[text] = parse_items(text, test)
+            items_list.append([dict(item) for item in items_by_text[text]])
+        else:
+            items_list.append(None)
+
+    return fields_list, items_list
+
 
 # Alt kalemler (Ara Kalemler) listeleri arasından toplam tutara en yakın olanı seçer
 def find_best_components(all_components, toplam_val, test = False):
@@ -276,39 +341,46 @@ def find_best_components(all_components, toplam_val, test = False):
     return closest_components if closest_components is not None else []
 
 
+# Alt kalem ayrıştırmada kullanılan regexler (import sırasında bir kez derlenir)
+# Sipariş Numarası veya Fiş No geçen satır başlangıç, Toplam geçen satır bitiş olarak kullanılır
+ORDER_NUMBER_LINE_PATTERN = re.compile(r"Sipariş\s+Numara(sı|si)", re.IGNORECASE)
+FIS_NO_LINE_PATTERN = re.compile(r"F[İIıi1]?[İIıi1]?[İIıi1]?[ŞŞşsS]?\s*NO\s*:?\s*\d+", re.IGNORECASE)
+TOPLAM_LINE_PATTERN = re.compile(r"\bToplam\b", re.IGNORECASE)
+CALCULATION_LINE_PATTERN = re.compile(r"^\d+\s*[Xx]\b")
+
+# Alt kalemlerin regex deseni (isim, KDV oranı, tutar)
+ITEM_PATTERN = re.compile(
+    r"^(.+?)\s+[&x\*]{0,3}\s*"
+    r"(1|8|01|08|10|18| \
+        11|18|101|108|110|118| \
+        21|28|201|208|210|218| \
+        41|48|401|408|410|418)"
+    r"(?=\s).*?([\d.]+)\s*,\s*(\d{2})\D*$"
+    # r"(?=\s|\W).*?([\d.]+)\s*,\s*(\d{2})\D*$"   # Alternatif bir regex, diğeri daha iyi çalışıyor
+)
+
 # OCR metninden alt kalem (Ara Kalemler) satırlarını tespit eder, her birini isim, KDV oranı ve tutar olarak parse eder
 def parse_items(text: str, test=False) -> list:
     lines = [l.strip() for l in text.splitlines() if l.strip()]
 
     # Sipariş Numarası veya Fiş No geçen satırı başlangıç olarak belirler, yoksa baştan başlar
-    start_idx = next((i for i, l in enumerate(lines) if re.search(r"Sipariş\s+Numara(sı|si)", l, re.IGNORECASE)), -1)
+    start_idx = next((i for i, l in enumerate(lines) if ORDER_NUMBER_LINE_PATTERN.search(l)), -1)
     if start_idx < 0:
-        start_idx = next((i for i, l in enumerate(lines) if re.search(r"F[İIıi1]?[İIıi1]?[İIıi1]?[ŞŞşsS]?\s*NO\s*:?\s*\d+", l, re.IGNORECASE)), -1)
+        start_idx = next((i for i, l in enumerate(lines) if FIS_NO_LINE_PATTERN.search(l)), -1)
     if start_idx < 0:
         start_idx = 0
 
     # Toplam kelimesi geçen satırı bitiş olarak belirler, bulunamazsa son satıra kadar alır
-    end_idx = next((i for i, l in enumerate(lines) if re.search(r"\bToplam\b", l, re.IGNORECASE)), len(lines))
+    end_idx = next((i for i, l in enumerate(lines) if TOPLAM_LINE_PATTERN.search(l)), len(lines))
     if end_idx <= start_idx: end_idx = len(lines)
 
     item_lines = lines[start_idx+1:end_idx]
     if test: print(f"[DEBUG] Lines between {start_idx} and {end_idx} are selected for parsing.")
     items = []
 
-    # Alt kalemlerin regex deseni (isim, KDV oranı, tutar)
-    item_re = re.compile(
-        r"^(.+?)\s+[&x\*]{0,3}\s*"
-        r"(1|8|01|08|10|18| \
-        11|18|101|108|110|118| \
-        21|28|201|208|210|218| \
-        41|48|401|408|410|418)"
-        r"(?=\s).*?([\d.]+)\s*,\s*(\d{2})\D*$"
-        # r"(?=\s|\W).*?([\d.]+)\s*,\s*(\d{2})\D*$"   # Alternatif bir regex, diğeri daha iyi çalışıyor
-    )
-
     for line in item_lines:
-        if re.match(r"^\d+\s*[Xx]\b", line): continue  # Bozuk hesaplama satırlarını (3 x 10.95 vs.) atla
-        m = item_re.match(line)
+        if CALCULATION_LINE_PATTERN.match(line): continue  # Bozuk hesaplama satırlarını (3 x 10.95 vs.) atla
+        m = ITEM_PATTERN.match(line)
         if not m: continue
         raw_name, rate_str, int_part, frac_part = m.groups()
 
@@ -350,7 +422,9 @@ def find_most_common_components_by_sum(all_components):
     
     return sum_to_components[most_common_sum][0]
 
+RECEIPT_MARKER_PATTERN = re.compile(r"F[İIıi1]?[İIıi1]?[İIıi1]?[ŞŞşsS5]", re.IGNORECASE)
+
 # Metinde fiş karakterleri olup olmadığını kontrol ederek belge türünü tahmin eder
 def is_receipt(text: str) -> bool:
-    fis_no_regex = re.search(r"F[İIıi1]?[İIıi1]?[İIıi1]?[ŞŞşsS5]", text, re.IGNORECASE)
+    fis_no_regex = RECEIPT_MARKER_PATTERN.search(text)
     return bool(fis_no_regex)
\ No newline at end of file
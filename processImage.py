@@ -9,38 +9,127 @@ from PIL import Image
 import numpy as np
 import cv2
 import os
-from autocrop_kh import autocrop
-import torch
+from autocrop_kh import autocrop, warmup_autocrop_model
+import functools
+
+# Autocrop modelinin varsayılan konumu (main.py ve crop() aynı modeli kullanır)
+# AUTOCROP_MODEL_PATH ile .onnx (örn. INT8 quantize edilmiş) bir model seçilebilir, bkz. autocrop_kh/export.py
+MODEL_PATH = os.environ.get("AUTOCROP_MODEL_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "autocrop_model_v2.pth")
+
+# AUTOCROP_LOW_MEMORY=1: kırpma görüntüyü uint8 tutar, float kopya ve zorunlu GC yapmaz (worker başına daha az bellek)
+LOW_MEMORY_CROP = os.environ.get("AUTOCROP_LOW_MEMORY") == "1"
+
+# Çözünürlük normalizasyonu (OCR_NORMALIZE=1): her senaryo girdisi, metin yüksekliği Tesseract'ın en iyi okuduğu aralığa
+# gelecek şekilde küçültülür veya büyütülür, OCR'a giden piksel sayısı OCR_MAX_PIXELS ile sınırlanır
+NORMALIZE_RESOLUTION = os.environ.get("OCR_NORMALIZE") == "1"
+TEXT_HEIGHT_RANGE = (20, 40)  # Ortanca karakter yüksekliği (piksel) bu aralıktaysa ölçek değişmez
+TARGET_TEXT_HEIGHT = 28
+MAX_NORMALIZE_UPSCALE = 3.0
+MAX_OCR_PIXELS = int(os.environ.get("OCR_MAX_PIXELS", "6000000"))
+
+# OCR girdisini etkileyen normalizasyon ayarları (sonuç önbelleği anahtarına girer)
+def normalize_settings():
+    return {"text_height_range": list(TEXT_HEIGHT_RANGE), "target_text_height": TARGET_TEXT_HEIGHT,
+            "max_upscale": MAX_NORMALIZE_UPSCALE, "max_pixels": MAX_OCR_PIXELS}
+
+# Decode edilmeden reddedilecek en büyük görüntü (decompression bomb koruması)
+MAX_IMAGE_PIXELS = int(os.environ.get("OCR_MAX_IMAGE_PIXELS", "50000000"))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS  # PIL de bu sınırın üstünde uyarı, 2 katında DecompressionBombError verir
+
+# preprocess_for_ocr bu kenar uzunluğunun altındaki görüntüleri 2 kat büyütür
+UPSCALE_MIN_SIDE = 800
+
+# CUDA destekliyse GPU, yoksa CPU döner
+# torch ilk kırpmada içe aktarılır (import süresini kırpma yapmayan çağrılar ödemez), sonuç süreç boyunca saklanır
+@functools.lru_cache(maxsize=None)
+def get_device():
+    try:
+        import torch
+    except ImportError:  # Sadece ONNX model kullanılan kurulumlarda torch gerekmez
+        return "cpu"
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+# Autocrop modelini süreç genelindeki model önbelleğine yükler ve bir kez çalıştırır
+# API veya batch worker'ları başlarken çağrılırsa ilk istek model yükleme maliyetini ödemez
+def warmup_crop_model(model_path=MODEL_PATH, device=None):
+    if device is None:
+        device = get_device()
+    warmup_autocrop_model(model_path, device)
+
+# NumPy dizisini uint8'e çevirir (0-255 aralığında float ise kırpar, 0-1 aralığında ise 255 ile çarpar), zaten uint8 ise kopyalamaz
+def to_uint8(image_array):
+    if image_array.dtype in [np.float32, np.float64]:
+        if np.max(image_array) > 1.5:  # 0-255 aralığında float ise uint8'e dönüştür
+            return np.clip(image_array, 0, 255).astype(np.uint8)
+        return (image_array * 255).astype(np.uint8)  # 0-1 aralığında float ise 255 ile çarpıp dönüştür
+    if image_array.dtype != np.uint8:
+        return image_array.astype(np.uint8)
+    return image_array
 
 # NumPy dizisini PIL Image objesine çevirir, tip ve kanal uyumsuzluklarını giderir
 def convert_to_pil(image_array):
     # if test_active: print(f"[DEBUG] Shape: {image_array.shape}, Dtype: {image_array.dtype}, Max: {np.max(image_array)}")
 
-    if image_array.dtype in [np.float32, np.float64]:
-        if np.max(image_array) > 1.5:  # 0-255 aralığında float ise uint8'e dönüştür
-            image_array = np.clip(image_array, 0, 255).astype(np.uint8)
-        else:                         # 0-1 aralığında float ise 255 ile çarpıp dönüştür
-            image_array = (image_array * 255).astype(np.uint8)
-    elif image_array.dtype != np.uint8:
-        image_array = image_array.astype(np.uint8)
+    image_array = to_uint8(image_array)
 
     if len(image_array.shape) == 2:  # Gri tonlu ise RGB kanalına çevir
         image_array = cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
 
     return Image.fromarray(image_array)
 
+# Ön işleme aşamaları: her biri uint8 NumPy dizisi (RGB veya gri) alır ve uint8 NumPy dizisi döndürür
+
+# Görüntünün eni veya boyu min_side'dan küçükse scale oranında büyütür
+def upscale_stage(img, scale=2.0, min_side=UPSCALE_MIN_SIDE):
+    h, w = img.shape[:2]
+    if w < min_side or h < min_side:
+        return cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_LANCZOS4)
+    return img
+
+def gray_stage(img):
+    return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
+
+# Adaptive Thresholding (yazıları netleştirir)
+def threshold_stage(img):
+    return cv2.adaptiveThreshold(gray_stage(img), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 21, 10)
+
+# Gürültü azaltma
+def denoise_stage(img):
+    return cv2.medianBlur(img, 3)
+
+PREPROCESS_STAGES = {
+    "upscale": upscale_stage,
+    "gray": gray_stage,
+    "threshold": threshold_stage,
+    "denoise": denoise_stage,
+}
+
+# Ön işleme senaryosunda sırayla uygulanan aşamalar, OCR_PREPROCESS_CHAIN ile değiştirilebilir (örn. "gray,threshold")
+DEFAULT_PREPROCESS_CHAIN = ["upscale", "gray", "threshold", "denoise"]
+PREPROCESS_CHAIN = [name.strip() for name in os.environ.get("OCR_PREPROCESS_CHAIN", ",".join(DEFAULT_PREPROCESS_CHAIN)).split(",") if name.strip()]
+
+# Aşama isimlerinden fonksiyon zinciri oluşturur
+def build_chain(names):
+    unknown = [name for name in names if name not in PREPROCESS_STAGES]
+    if unknown:
+        raise ValueError(f"Unknown preprocessing stage(s): {', '.join(unknown)}. Supported stages are {', '.join(PREPROCESS_STAGES)}")
+    return [PREPROCESS_STAGES[name] for name in names]
+
+# uint8 NumPy görüntüsünü verilen aşama isimleriyle (varsayılan PREPROCESS_CHAIN) ön işler
+# upscale False ise büyütme aşaması atlanır (çözünürlük normalize_resolution ile zaten ayarlanmışsa)
+def preprocess_array(img, chain=None, upscale=True):
+    names = PREPROCESS_CHAIN if chain is None else chain
+    if not upscale:
+        names = [name for name in names if name != "upscale"]
+    for stage in build_chain(names):
+        img = stage(img)
+    return img
+
 # OCR için uygun şekilde görüntüyü ön işlemden geçirir:
 # Yüksekliği düşükse büyütür, gri tonlamaya çevirir, adaptif eşikleme ve bulanıklaştırma uygular
-def preprocess_for_ocr(pil_img: Image.Image) -> Image.Image:
-        
-    pil = upscale_image(pil_img) # Eğer belli bir çözünürlüğün altındaysa upscale ediyor
-
-    img = np.array(pil.convert("L")) # PIL -> NumPy (grayscale)
-
-    img = cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 21, 10) # Adaptive Thresholding (yazıları netleştirir)
-    
-    img = cv2.medianBlur(img, 3)  # Gürültü azaltma
-
+# PIL Image alan ve döndüren eski arayüz; iş akışı preprocess_array ile doğrudan NumPy dizileri üzerinde çalışır
+def preprocess_for_ocr(pil_img: Image.Image, upscale=True) -> Image.Image:
+    img = preprocess_array(np.asarray(pil_img.convert("RGB")), upscale=upscale)
     return Image.fromarray(img) # NumPy -> PIL
 
 # Görüntü belirlenen alt çözünürlüğün altındaysa belirli oranda büyütür
@@ -53,21 +142,70 @@ def upscale_image(pil_img: Image.Image, scale=2.0) -> Image.Image:
     return pil_img
 
 # Görüntünün eni veya boyu minimum piksel değerinin altındaysa True döner
-def needs_upscale(pil_img: Image.Image, min_side=800) -> bool:
+def needs_upscale(pil_img: Image.Image, min_side=UPSCALE_MIN_SIDE) -> bool:
     """Return True if either side is below min_side px."""
     w, h = pil_img.size
     print(f"Image size {w} by {h}")
     return w < min_side or h < min_side
 
+class ImageTooLargeError(ValueError):
+    pass
+
+# Görüntü piksel sınırını aşıyorsa hata fırlatır; Image.open sadece başlığı okuduğu için decode'dan önce çağrılabilir
+def check_image_size(width, height):
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(f"Image is too large ({width}x{height}, limit {MAX_IMAGE_PIXELS} pixels), possible decompression bomb")
+
+# Binarize edilmiş görüntüdeki bağlı bileşenlerden ortanca karakter yüksekliğini (piksel) tahmin eder
+# Hız için görüntü en fazla max_side kenara küçültülerek ölçülür; yeterli karakter bulunamazsa None döner
+def estimate_text_height(img, max_side=2000, min_components=30):
+    gray = gray_stage(img)
+    h, w = gray.shape
+    factor = min(1.0, max_side / max(h, w))
+    if factor < 1.0:
+        gray = cv2.resize(gray, (max(1, int(w * factor)), max(1, int(h * factor))), interpolation=cv2.INTER_AREA)
+
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)  # Yazı beyaz, zemin siyah
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    fill = areas / np.maximum(widths * heights, 1)
+
+    # Karakter benzeri bileşenler: gürültü kadar küçük, çizgi/kenar kadar uzun veya dolu blok olanlar elenir
+    is_char = (heights >= 4) & (heights <= binary.shape[0] // 10) & (widths <= heights * 1.5) & (areas >= 8) & (fill > 0.1) & (fill < 0.9)
+    if np.count_nonzero(is_char) < min_components:
+        return None
+    return float(np.median(heights[is_char])) / factor
+
+# Görüntüyü ortanca karakter yüksekliği TARGET_TEXT_HEIGHT olacak şekilde ölçekler (TEXT_HEIGHT_RANGE içindeyse dokunmaz)
+# ve piksel sayısını MAX_OCR_PIXELS ile sınırlar. uint8 NumPy görüntüsü alır, (görüntü, {"text_height", "scale"}) döndürür
+def normalize_resolution(img, max_pixels=None):
+    max_pixels = max_pixels or MAX_OCR_PIXELS
+    text_height = estimate_text_height(img)
+
+    scale = 1.0
+    if text_height and not (TEXT_HEIGHT_RANGE[0] <= text_height <= TEXT_HEIGHT_RANGE[1]):
+        scale = min(TARGET_TEXT_HEIGHT / text_height, MAX_NORMALIZE_UPSCALE)
+
+    h, w = img.shape[:2]
+    scale = min(scale, (max_pixels / (w * h)) ** 0.5)
+
+    info = {"text_height": round(text_height, 1) if text_height else None, "scale": round(scale, 3)}
+    if abs(scale - 1.0) < 0.05:  # Küçük ölçek farkları için yeniden örnekleme yapılmaz
+        info["scale"] = 1.0
+        return img, info
+
+    new_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LANCZOS4
+    return cv2.resize(img, new_size, interpolation=interpolation), info
+
 # Görüntüyü model ile kırpar ve gerekirse test için kaydeder
-# CUDA destekliyse GPU üzerinde çalışır, yoksa CPU kullanır
+# CUDA destekliyse GPU üzerinde çalışır, yoksa CPU kullanır (model süreç başına bir kez yüklenir)
 # test_active True ise kırpılmış görüntüyü processed_receipts klasörüne kaydeder
 def crop(image_path, test_active = False):    
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    model_path = os.path.join(current_dir, "models", "autocrop_model_v2.pth")
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-
-    cropped_array = autocrop(img_path=image_path, model_path=model_path, device=device)
+    cropped_array = autocrop(img_path=image_path, model_path=MODEL_PATH, device=get_device(), low_memory=LOW_MEMORY_CROP)
     cropped_img = convert_to_pil(cropped_array)
 
     if test_active:
@@ -0,0 +1,198 @@
+# OCR sonuçları için içerik adresli önbellek.
+#
+# Anahtar, görüntü byte'larının hash'i ile iş akışı yapılandırmasının hash'inden (PSM listesi, senaryolar,
+# erken çıkış eşiği, OCR backend'i, autocrop model dosyasının hash'i ve postProcess sürümü) oluşur.
+# Böylece aynı fotoğraf tekrar yüklendiğinde veya batch işi yeniden çalıştırıldığında OCR tekrar yapılmaz;
+# yapılandırma veya regexler değişince eski kayıtlar kendiliğinden geçersiz olur.
+#
+# İki katman vardır:
+# - MemoryLRUCache: süreç içi, boyut sınırlı LRU
+# - SQLiteCache: diskte kalıcı, boyut sınırlı (en uzun süredir kullanılmayan kayıtlar silinir)
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from postProcess import POSTPROCESS_VERSION
+
+# Byte dizisinin SHA-256 hash'i
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+# Dosyayı parça parça okuyarak SHA-256 hash'ini hesaplar
+def hash_file(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+_model_hashes = {}
+
+# Model dosyasının hash'i (dosya değişmediği sürece süreç başına bir kez hesaplanır), dosya yoksa None
+def model_file_hash(model_path):
+    if not os.path.exists(model_path):
+        return None
+    stat = os.stat(model_path)
+    key = (os.path.abspath(model_path), stat.st_size, stat.st_mtime)
+    if key not in _model_hashes:
+        _model_hashes[key] = hash_file(model_path)
+    return _model_hashes[key]
+
+# İş akışı yapılandırmasının hash'i; sonucu etkileyen her ayar buraya girmeli
+def pipeline_config_hash(psm_values, scenarios, agreement=None, model_path=None, backend=None, roi=False, normalize=False, passes=None,
+                         preprocess_chain=None, low_memory_crop=False):
+    config = {
+        "psm_values": list(psm_values),
+        "scenarios": [list(s) for s in scenarios],
+        "agreement": agreement,
+        "model": model_file_hash(model_path) if model_path else None,
+        "backend": backend,
+        "postprocess": POSTPROCESS_VERSION,
+    }
+    # Sadece açıkken eklenir, varsayılan yapılandırmanın mevcut anahtarları değişmesin
+    if roi:
+        config["roi"] = True
+    if normalize:  # True veya ayarlar (bkz. processImage.normalize_settings)
+        config["normalize"] = normalize
+    if passes is not None:  # Varsayılandan farklı geçiş planı (bkz. pass_schedule.py)
+        config["passes"] = [list(p) for p in passes]
+    if preprocess_chain is not None:  # Varsayılandan farklı ön işleme zinciri (OCR_PREPROCESS_CHAIN)
+        config["preprocess_chain"] = list(preprocess_chain)
+    if low_memory_crop:  # AUTOCROP_LOW_MEMORY: sayfa kenarında ±1 gri seviye farklı kırpma
+        config["low_memory_crop"] = True
+    return hash_bytes(json.dumps(config, sort_keys=True).encode("utf-8"))
+
+# Görüntü hash'i ve yapılandırma hash'inden önbellek anahtarı üretir
+def cache_key(image_hash, config_hash):
+    return f"{image_hash}:{config_hash}"
+
+# Süreç içi LRU önbellek; değerler JSON metni olarak tutulur, toplam boyut max_bytes'ı geçince en eski kayıtlar silinir
+class MemoryLRUCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+# Diskte kalıcı SQLite önbellek; toplam boyut max_bytes'ı geçince en uzun süredir erişilmeyen kayıtlar silinir
+class SQLiteCache:
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM results ORDER BY last_access").fetchall():
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Bellek ve disk katmanlarını birleştirir: önce bellekte, sonra diskte arar; diskte bulunanı belleğe de alır
+class ResultCache:
+    def __init__(self, memory=None, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key) if self.memory else None
+        if value is None and self.disk:
+            value = self.disk.get(key)
+            if value is not None and self.memory:
+                self.memory.put(key, value)
+
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def put(self, key, result):
+        value = json.dumps(result, ensure_ascii=False)
+        if self.memory:
+            self.memory.put(key, value)
+        if self.disk:
+            self.disk.put(key, value)
+
+# Ortam değişkenlerine göre varsayılan önbelleği oluşturur:
+# OCR_CACHE_MEMORY_MB (0 = bellek katmanı kapalı), OCR_CACHE_PATH, OCR_CACHE_DISK_MB.
+# Disk katmanı varsayılan kapalıdır: açılırsa yüklenen görüntülerin sonuçları diske yazılır (örn. cache/results.sqlite)
+def create_default_cache():
+    memory_mb = int(os.environ.get("OCR_CACHE_MEMORY_MB", "64"))
+    disk_path = os.environ.get("OCR_CACHE_PATH", "")
+    disk_mb = int(os.environ.get("OCR_CACHE_DISK_MB", "512"))
+
+    memory = MemoryLRUCache(memory_mb * 1024 * 1024) if memory_mb > 0 else None
+    disk = SQLiteCache(disk_path, disk_mb * 1024 * 1024) if disk_path else None
+    return ResultCache(memory, disk)
@@ -1,5 +1,25 @@
+# Örnek fişler üzerinde doğruluk ve gecikme testi.
+#
+# - Fişler worker süreçlerine dağıtılır, her biri için alanlar beklenen değerlerle karşılaştırılır.
+# - Alan başına doğruluk, fiş başına gecikmenin p50/p95 değerleri ve kullanılan OCR geçişi sayısı raporlanır.
+# - --replay ile OCR yapılmadan kayıtlı metinler kullanılır (postProcess değişikliklerini saniyeler içinde ölçmek için).
+# - --save-baseline ile özet kaydedilir, --baseline ile doğruluk düşer veya gecikme eşikten fazla artarsa çıkış kodu 1 olur.
+#
+# Örnek:
+#   python test.py --save-baseline cache/test_baseline.json
+#   python test.py --agreement 3 --baseline cache/test_baseline.json
+#   python test.py --roi --baseline cache/test_baseline.json   # ROI modunun gerçek gecikme farkı
+#   python test.py --replay -w 8
+
 import os
-from main import run
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from ocr_store import DEFAULT_STORE_PATH
+from batch import init_worker, process_image
 
 SAMPLES_DIR = 'Karel/receipts'                  # Fişlerin olduğu klasör neyse aynı dir de güncelle
 
@@ -163,52 +183,172 @@ expected_outputs = {                            # manuel girme yeri
 
 FIELDS = ["Tarih", "Toplam", "Toplam KDV"]      # Field'lar, daha fazla eklenebilir
 
-def test_receipts():
-    total_fields = len(FIELDS) * len(expected_outputs)
-    correct_fields = 0
+# Tahmin edilen değer beklenenle aynı mı (metin olarak karşılaştırılır, bkz. pass_schedule.py)
+def field_matches(predicted, expected):
+    return str(predicted if predicted is not None else "").strip() == str(expected if expected is not None else "").strip()
+
+# Tek bir fişi worker'da çalıştırır (bkz. batch.process_image), tahmin edilen alanları, süreyi ve kullanılan geçiş
+# sayısını döndürür (hatalar da kayıt olarak döner). Worker'lar batch.init_worker ile başlatılır.
+def evaluate(filepath):
+    result = process_image(filepath)
+    record = {"filename": os.path.basename(filepath), "seconds": result["wall_ms"] / 1000}
+    if result["status"] == "ok":
+        record.update({"predicted": {field: result["result"].get(field) for field in FIELDS}, "passes_used": result["passes_used"]})
+    else:
+        record["error"] = result["error"]
+    return record
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+# Fiş kayıtlarından alan başına doğruluk, gecikme ve geçiş sayısı özetini çıkarır
+def summarize(records):
+    field_correct = {field: 0 for field in FIELDS}
     failed_receipts = 0
+    for record in records:
+        correct = record.get("correct", {})
+        for field in FIELDS:
+            field_correct[field] += int(correct.get(field, False))
+        if not all(correct.get(field, False) for field in FIELDS):
+            failed_receipts += 1
 
-    for i in range(1, len(expected_outputs) + 1):
-        filename = f"S{i}.jpg"
-        filepath = os.path.join(SAMPLES_DIR, filename)
+    count = len(records)
+    seconds = [r["seconds"] for r in records if "error" not in r]
+    passes = [r["passes_used"] for r in records if "passes_used" in r]
+    total_fields = len(FIELDS) * count
+    return {
+        "receipts": count,
+        "failed_receipts": failed_receipts,
+        "errors": sum(1 for r in records if "error" in r),
+        "accuracy": sum(field_correct.values()) / total_fields * 100 if total_fields else 0.0,
+        "field_accuracy": {field: field_correct[field] / count * 100 if count else 0.0 for field in FIELDS},
+        "latency_p50": percentile(seconds, 50),
+        "latency_p95": percentile(seconds, 95),
+        "passes_mean": float(np.mean(passes)) if passes else None,
+        "passes_p95": percentile(passes, 95),
+    }
+
+# Özeti baseline ile karşılaştırır, regresyonları açıklayan satırların listesini döndürür
+# Alan doğruluğu max_accuracy_drop puandan fazla düşerse veya p50/p95 gecikme latency_threshold oranından fazla artarsa regresyon sayılır
+def compare_to_baseline(summary, baseline, max_accuracy_drop=0.0, latency_threshold=0.2):
+    regressions = []
+    for field, accuracy in summary["field_accuracy"].items():
+        before = baseline["field_accuracy"].get(field)
+        if before is not None and before - accuracy > max_accuracy_drop:
+            regressions.append(f"{field} accuracy {before:.2f}% -> {accuracy:.2f}%")
+    for metric in ("latency_p50", "latency_p95"):
+        before, after = baseline.get(metric), summary.get(metric)
+        if before and after and (after - before) / before > latency_threshold:
+            regressions.append(f"{metric} {before:.2f}s -> {after:.2f}s (+{(after - before) / before:.0%})")
+    return regressions
 
+# Fişleri worker süreçlerinde çalıştırır ve sonuçları istek sırasıyla yazdırır
+# Normal çalışmada ham OCR metinleri store'a kaydedilir; replay True ise OCR yapılmadan kayıtlı metinler kullanılır
+# (postProcess'teki regex değişikliklerini tüm korpus üzerinde saniyeler içinde ölçmek için)
+def test_receipts(replay=False, store_path=DEFAULT_STORE_PATH, workers=None, agreement=None, backend=None, samples_dir=SAMPLES_DIR, warmup=True, profile=None, roi=False):
+    filepaths = []
+    for i in range(1, len(expected_outputs) + 1):
+        filepath = os.path.join(samples_dir, f"S{i}.jpg")
         if not os.path.exists(filepath):
             print(f"❌ Missing file: {filepath}")
             continue
+        filepaths.append(filepath)
 
-        print(f"\n🧾 Testing {filename}...")
-        predicted = run(filepath)
-        expected = expected_outputs.get(filename)
+    options = {"replay": replay, "store": store_path, "agreement": agreement, "backend": backend, "warmup": warmup, "profile": profile, "roi": roi}
+    workers = max(1, min(workers or os.cpu_count() or 1, len(filepaths) or 1))
 
-        if not expected:
-            print(f"⚠️ No expected result for {filename}, skipping.")
-            continue
+    records = []
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(options,)) as pool:
+        for record in pool.imap(evaluate, filepaths):
+            filename = record["filename"]
+            expected = expected_outputs[filename]
+            print(f"\n🧾 Testing {filename}... ({record['seconds']:.2f}s, {record.get('passes_used', '-')} passes)")
 
-        receipt_passed = True
+            if "error" in record:
+                print(f"   ❌ {record['error']}")
+                record["correct"] = {}
+                records.append(record)
+                continue
 
-        for field in FIELDS:
-            pred = str(predicted.get(field, "")).strip()
-            exp = str(expected.get(field, "")).strip()
-
-            if pred == exp:
-                correct_fields += 1
-                print(f"   ✅ {field}: got '{pred}'")
-            else:
-                receipt_passed = False
-                print(f"   ❌ {field}: expected '{exp}', got '{pred}'")
-
-        if receipt_passed:
-            print(f"✅ All fields passed for {filename}")
-        else:
-            failed_receipts += 1
+            record["correct"] = {}
+            for field in FIELDS:
+                pred = str(record["predicted"].get(field, "")).strip()
+                exp = str(expected.get(field, "")).strip()
+                record["correct"][field] = field_matches(record["predicted"].get(field, ""), expected.get(field, ""))
+
+                if record["correct"][field]:
+                    print(f"   ✅ {field}: got '{pred}'")
+                else:
+                    print(f"   ❌ {field}: expected '{exp}', got '{pred}'")
 
-    accuracy = (correct_fields / total_fields) * 100
+            if all(record["correct"].values()):
+                print(f"✅ All fields passed for {filename}")
+            records.append(record)
 
+    summary = summarize(records)
+    summary["wall_seconds"] = time.perf_counter() - start
+    summary["config"] = {"replay": replay, "agreement": agreement, "backend": backend, "workers": workers, "profile": profile, "roi": roi}
+
+    total_fields = len(FIELDS) * summary["receipts"]
+    correct_fields = round(summary["accuracy"] * total_fields / 100)
     print("\n📊 Test Summary:")
     print(f"✅ Correct fields: {correct_fields}/{total_fields}")
     print(f"❌ Incorrect fields: {total_fields - correct_fields}")
-    print(f"🧾 Receipts with any error: {failed_receipts}/{len(expected_outputs)}")
-    print(f"🎯 Accuracy: {accuracy:.2f}%")
+    for field, accuracy in summary["field_accuracy"].items():
+        print(f"   {field}: {accuracy:.2f}%")
+    print(f"🧾 Receipts with any error: {summary['failed_receipts']}/{summary['receipts']}")
+    print(f"🎯 Accuracy: {summary['accuracy']:.2f}%")
+    if summary["latency_p50"] is not None:
+        print(f"⏱️ Latency per receipt: p50 {summary['latency_p50']:.2f}s, p95 {summary['latency_p95']:.2f}s "
+              f"({summary['wall_seconds']:.1f}s total with {workers} workers)")
+    if summary["passes_mean"] is not None:
+        print(f"🔁 OCR passes per receipt: mean {summary['passes_mean']:.1f}, p95 {summary['passes_p95']:.0f}")
+    return summary
 
 if __name__ == "__main__":
-    test_receipts()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replay", action="store_true", help="Re-run extraction on stored OCR texts, skip imaging and OCR")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help="OCR text store path")
+    parser.add_argument("--samples", default=SAMPLES_DIR, help="Directory with S1.jpg ... S31.jpg")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--agreement", type=int, default=None, help="Early-exit vote margin for required fields (0 or default: run all passes)")
+    parser.add_argument("--backend", default=None, help="OCR backend (pytesseract or tesserocr)")
+    parser.add_argument("--profile", default=None, help="Pass schedule profile name or .json path (see pass_schedule.py)")
+    parser.add_argument("--roi", action="store_true", help="OCR only the lines holding key fields after one full-page pass")
+    parser.add_argument("--no-warmup", action="store_true", help="Do not preload the autocrop model in workers")
+    parser.add_argument("--save-baseline", help="Write the summary to this JSON file")
+    parser.add_argument("--baseline", help="Compare with this summary, exit 1 on accuracy or latency regression")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.0, help="Allowed per-field accuracy drop in percentage points")
+    parser.add_argument("--latency-threshold", type=float, default=0.2, help="Allowed relative p50/p95 latency increase (default 0.2 = 20%%)")
+    args = parser.parse_args()
+    if args.replay and args.roi:
+        parser.error("--roi cannot be combined with --replay")
+    if args.agreement is not None and args.agreement < 0:
+        parser.error("--agreement must be 0 (off) or at least 1")
+    args.agreement = args.agreement or None  # API'deki OCR_AGREEMENT gibi 0 erken çıkışı kapatır
+
+    summary = test_receipts(args.replay, args.store, args.workers, args.agreement, args.backend, args.samples, not args.no_warmup, args.profile, args.roi)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config", {}).get("replay") != args.replay:
+            print("⚠️ Baseline was recorded with a different --replay setting, latency is not comparable")
+        for metric in ("latency_p50", "latency_p95"):  # Örn. --roi veya bir profilin tam plana göre gerçek süre kazancı
+            before, after = baseline.get(metric), summary.get(metric)
+            if before and after is not None:
+                print(f"⏱️ {metric} vs baseline: {before:.2f}s -> {after:.2f}s ({(after - before) / before:+.0%}, {after - before:+.2f}s)")
+        regressions = compare_to_baseline(summary, baseline, args.max_accuracy_drop, args.latency_threshold)
+        if regressions:
+            print("\n🚨 Regressions against baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print("\n✅ No regressions against baseline")
@@ -0,0 +1,56 @@
+# Autocrop sonucunun "tüm kare" kabul edilip kırpılmamış görüntüyle değiştirilmesi kontrolü; model gerekmez.
+#
+# - Sayfa köşeleri görüntü köşelerindeyse kırpılmamış görüntü kullanılır.
+# - Kareyi dolduran ama eğik/perspektifli bir sayfa, warp sonucu kaynakla aynı boyutta olsa da düzeltilmiş haliyle kalır.
+#
+# Örnek:
+#   python test_autocrop.py
+#   python -m pytest -q test_autocrop.py
+
+import numpy as np
+
+from autocrop_kh import is_whole_frame, warp_page
+from main import ScenarioGraph, WHOLE_FRAME_TOLERANCE
+
+H, W = 800, 600
+
+def make_image():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (H, W, 3), dtype=np.uint8)
+
+def test_frame_corners_are_whole_frame():
+    corners = np.float32([[3, 2], [W - 4, 0], [W, H - 5], [0, H]])
+    assert is_whole_frame(corners, H, W, WHOLE_FRAME_TOLERANCE)
+
+    source = make_image()
+    graph = ScenarioGraph(source)
+    assert graph._crop_result(source, warp_page(source, corners), corners) is source
+
+def test_skewed_full_frame_page_keeps_perspective_correction():
+    # Kamera eğik tutulmuş: sol üst köşe içeride, sayfa yine de kareyi dolduruyor
+    corners = np.float32([[60, 0], [W, 0], [W, H], [0, H]])
+    source = make_image()
+    warped = warp_page(source, corners)
+
+    # Warp sonucu kaynakla %2 içinde aynı boyutta (eski boyut kontrolü bunu tüm kare sayıp atıyordu)
+    assert abs(warped.shape[0] - H) <= H * WHOLE_FRAME_TOLERANCE and abs(warped.shape[1] - W) <= W * WHOLE_FRAME_TOLERANCE
+    assert not is_whole_frame(corners, H, W, WHOLE_FRAME_TOLERANCE)
+
+    graph = ScenarioGraph(source)
+    result = graph._crop_result(source, warped, corners)
+    assert result is not source
+    assert result.shape == warped.shape and np.array_equal(result, warped)
+
+def test_page_inside_frame_is_cropped():
+    corners = np.float32([[100, 80], [W - 90, 100], [W - 100, H - 60], [80, H - 90]])
+    source = make_image()
+    warped = warp_page(source, corners)
+    assert not is_whole_frame(corners, H, W, WHOLE_FRAME_TOLERANCE)
+    assert ScenarioGraph(source)._crop_result(source, warped, corners) is not source
+
+if __name__ == "__main__":
+    tests = [value for name, value in list(globals().items()) if name.startswith("test_") and callable(value)]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n{len(tests)} checks passed")
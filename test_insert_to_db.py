@@ -0,0 +1,133 @@
+# insert_to_db.py için SQLite yazıcısıyla (MSSQL yerine) upsert kontrolü; OCR ve veritabanı sunucusu gerekmez.
+#
+# - Aynı batch.py çıktısı (JSONL) iki kez yazılınca satırlar çoğalmaz, değerleri değişen kayıt güncellenir.
+# - 'Toplam' olmayan ve hatalı kayıtlar yazılmaz.
+# - --skip-existing ile tablodaki görüntüler tekrar OCR'lanmaz veya yazılmaz.
+# - Worker'lardan sonuç gelmese de bekleyen satırlar --flush-seconds dolunca yazılır.
+#
+# Örnek:
+#   python test_insert_to_db.py
+#   python -m pytest -q test_insert_to_db.py
+
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+import insert_to_db
+
+RESULT = {"Belge Türü": "Fiş", "Fiş No": "0042", "Tarih": "12.03.2024", "Toplam": 19.9, "Toplam KDV": 1.82}
+
+# Farklı içerikli sahte görüntü dosyaları (OCR yapılmaz, sadece hash'leri kullanılır)
+def make_images(directory, count):
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"S{i + 1}.jpg")
+        with open(path, "wb") as f:
+            f.write(f"image {i}".encode())
+        paths.append(path)
+    return paths
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def read_rows(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT ImagePath, FisNo, BelgeTarihi, Toplam, ImageHash FROM Documents ORDER BY ImagePath").fetchall()
+
+def test_same_jsonl_twice_upserts_one_row_per_image():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_images(tmp, 2)
+        db_path, jsonl_path = os.path.join(tmp, "documents.sqlite"), os.path.join(tmp, "results.jsonl")
+
+        write_jsonl(jsonl_path, [{"path": path, "status": "ok", "result": RESULT} for path in paths])
+        assert insert_to_db.main(["--jsonl", jsonl_path, "--sqlite", db_path]) == 0
+        assert insert_to_db.main(["--jsonl", jsonl_path, "--sqlite", db_path]) == 0
+        rows = read_rows(db_path)
+        assert len(rows) == 2
+        assert {row[4] for row in rows} == {insert_to_db.hash_file(path) for path in paths}
+        assert rows[0][1:4] == ("0042", "2024-03-12", 19.9)
+
+        # Aynı görüntünün yeni sonucu satırı günceller
+        write_jsonl(jsonl_path, [{"path": paths[0], "status": "ok", "result": {**RESULT, "Toplam": 25.5}}])
+        assert insert_to_db.main(["--jsonl", jsonl_path, "--sqlite", db_path]) == 0
+        rows = read_rows(db_path)
+        assert len(rows) == 2
+        assert [row[3] for row in rows] == [25.5, 19.9]
+
+def test_missing_total_and_errors_are_not_written():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_images(tmp, 2)
+        db_path, jsonl_path = os.path.join(tmp, "documents.sqlite"), os.path.join(tmp, "results.jsonl")
+
+        write_jsonl(jsonl_path, [
+            {"path": paths[0], "status": "ok", "result": {**RESULT, "Toplam": None}},
+            {"path": paths[1], "status": "error", "error": "ValueError: bad image"},
+        ])
+        assert insert_to_db.main(["--jsonl", jsonl_path, "--sqlite", db_path]) == 1  # Hatalı kayıt çıkış kodunu 1 yapar
+        assert read_rows(db_path) == []
+
+def test_skip_existing():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_images(tmp, 3)
+        db_path, jsonl_path = os.path.join(tmp, "documents.sqlite"), os.path.join(tmp, "results.jsonl")
+
+        write_jsonl(jsonl_path, [{"path": path, "status": "ok", "result": RESULT} for path in paths[:2]])
+        assert insert_to_db.main(["--jsonl", jsonl_path, "--sqlite", db_path]) == 0
+
+        # Tablodaki görüntülerin yeni değerleri yazılmaz, sadece yeni görüntü eklenir
+        write_jsonl(jsonl_path, [{"path": path, "status": "ok", "result": {**RESULT, "Toplam": 1.0}} for path in paths])
+        assert insert_to_db.main(["--jsonl", jsonl_path, "--sqlite", db_path, "--skip-existing"]) == 0
+        assert [row[3] for row in read_rows(db_path)] == [19.9, 19.9, 1.0]
+
+        # Tüm görüntüler tabloda: OCR worker'ları hiç başlatılmaz
+        assert insert_to_db.main([tmp, "--sqlite", db_path, "--skip-existing"]) == 0
+        assert len(read_rows(db_path)) == 3
+
+# Pool.imap_unordered gibi davranan sahte sonuç akışı: ilk grubu verir, sonra worker'lar meşgulmüş gibi bekletir
+class SlowResults:
+    def __init__(self, chunks, idle_polls, on_idle):
+        self.chunks = list(chunks)
+        self.idle_polls = idle_polls
+        self.on_idle = on_idle
+
+    def next(self, timeout=None):
+        if self.chunks and (len(self.chunks) > 1 or self.idle_polls == 0):
+            return self.chunks.pop(0)
+        if self.idle_polls:
+            self.idle_polls -= 1
+            self.on_idle()
+            raise multiprocessing.TimeoutError
+        raise StopIteration
+
+def test_flush_seconds_without_new_results():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_images(tmp, 2)
+        db_path = os.path.join(tmp, "documents.sqlite")
+        records = [{"path": path, "status": "ok", "result": RESULT, "image_hash": insert_to_db.hash_file(path)} for path in paths]
+        writer = insert_to_db.SQLiteWriter(db_path)
+        counts = []
+
+        # Her beklemede o ana kadar yazılmış satırlar kaydedilir, sonra süre dolana kadar beklenir
+        def idle():
+            counts.append(len(read_rows(db_path)))
+            time.sleep(0.2)
+
+        results = SlowResults([records[:1], records[1:]], idle_polls=2, on_idle=idle)
+        try:
+            assert insert_to_db.ingest(results, writer, batch_size=100, flush_seconds=0.1) == (0, 0)
+        finally:
+            writer.close()
+        assert counts == [0, 1]  # İlk grup, son grup gelmeden süre dolunca yazıldı
+        assert len(read_rows(db_path)) == 2
+
+if __name__ == "__main__":
+    tests = [value for name, value in list(globals().items()) if name.startswith("test_") and callable(value)]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n{len(tests)} checks passed")